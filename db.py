@@ -1,39 +1,343 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-
-load_dotenv()
-
-engine = create_engine(os.getenv("DATABASE_URL"), future=True)
-SessionLocal = sessionmaker(bind=engine)
-Base = declarative_base()
-class Player(Base):
-    __tablename__ = "players"
-    id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True)
-
-class Rating(Base):
-    __tablename__ = "ratings"
-    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
-    mu = Column(Float, default=1500)
-    phi = Column(Float, default=350)
-    sigma = Column(Float, default=0.06)
-
-class Match(Base):
-    __tablename__ = "matches"
-    id = Column(Integer, primary_key=True)
-    played_at = Column(DateTime)
-    player_id = Column(Integer)
-    opponent_id = Column(Integer)
-    score = Column(Float)
-
-class RatingHistory(Base):
-    __tablename__ = "rating_history"
-    id = Column(Integer, primary_key=True)
-    match_id = Column(Integer)
-    player_id = Column(Integer)
-    mu_before = Column(Float)
-    mu_after = Column(Float)
-    phi_before = Column(Float)
-    phi_after = Column(Float)
+# db.py — Capa de persistencia de TimeSplit (SQLAlchemy)
+# --------------------------------------------------------------------------------------
+# - Un único registro declarativo (Base) con los modelos del juego
+# - Engine/SessionLocal a partir de DATABASE_URL (.env); si no existe, SQLite local
+# - Helpers orm_* usados por timesplit_game.py
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import List, Dict, Tuple, Optional
+
+# --- cargar .env (si existe) ---
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+from sqlalchemy import (
+    create_engine, event, Column, Integer, Float, String, Text, Boolean,
+    ForeignKey, UniqueConstraint, Index, select, insert, update, delete, inspect, lambda_stmt
+)
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+
+Base = declarative_base()
+
+def _db_url() -> str:
+    # Prioridad: DATABASE_URL (ideal para Postgres). Si no, SQLite local.
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if url:
+        return url
+    return "sqlite:///timesplit.sqlite"
+
+ENGINE = create_engine(_db_url(), echo=False, future=True)
+
+if ENGINE.dialect.name == "sqlite":
+    # WAL + synchronous=NORMAL: un commit ya no paga los fsync del rollback journal.
+    # Para un juego de escritorio de un solo proceso no cambia el comportamiento.
+    @event.listens_for(ENGINE, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-20000")
+        cur.close()
+SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, autocommit=False, future=True)
+
+class OrganizationORM(Base):
+    __tablename__ = "organizations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+
+    players = relationship("PlayerORM", back_populates="organization")
+
+class PlayerORM(Base):
+    __tablename__ = "players"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False, index=True)
+    is_bot = Column(Boolean, default=False, nullable=False)
+
+    # Glicko-2 params almacenados en escala "rating" (tipo Elo), RD y volatility
+    rating = Column(Float, default=1500.0, nullable=False)  # r
+    rd = Column(Float, default=350.0, nullable=False)       # RD
+    vol = Column(Float, default=0.06, nullable=False)       # sigma
+
+    organization = relationship("OrganizationORM", back_populates="players")
+
+    __table_args__ = (
+        UniqueConstraint("org_id", "name", name="uix_org_playername"),
+        # Ranking: WHERE org_id=? ORDER BY rating DESC LIMIT n (cubre name/rd/vol en Postgres)
+        Index("ix_players_org_rating", "org_id", rating.desc(), postgresql_include=["name", "rd", "vol"]),
+    )
+
+class GameSessionORM(Base):
+    __tablename__ = "game_sessions"
+    id = Column(String, primary_key=True)                 # uid
+    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
+    player_name = Column(String, nullable=False)
+    mode = Column(String, nullable=False)                 # "carreras" | "futbol"
+    started_at = Column(Integer, nullable=False)          # epoch ms
+    duration_ms = Column(Integer, nullable=False)
+    total_score = Column(Float, nullable=False)
+
+    splits = relationship("SplitORM", cascade="all, delete-orphan", back_populates="session")
+
+class SplitORM(Base):
+    __tablename__ = "splits"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String, ForeignKey("game_sessions.id", ondelete="CASCADE"), index=True)
+    t_ms = Column(Integer, nullable=False)
+    lap = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+    note = Column(Text, nullable=True)
+
+    session = relationship("GameSessionORM", back_populates="splits")
+    __table_args__ = (Index("ix_splits_session_t", "session_id", "t_ms"),)
+
+class MatchORM(Base):
+    __tablename__ = "matches"
+    id = Column(String, primary_key=True)                 # uid
+    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
+    played_at = Column(Integer, nullable=False)           # epoch ms
+
+    mode = Column(String, nullable=False)
+    session_id = Column(String, ForeignKey("game_sessions.id", ondelete="SET NULL"), nullable=True)
+
+    p1_id = Column(Integer, ForeignKey("players.id", ondelete="CASCADE"), nullable=False, index=True)
+    p2_id = Column(Integer, ForeignKey("players.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    score1 = Column(Float, nullable=False)
+    score2 = Column(Float, nullable=False)
+
+    # outcome1: 1 win, 0 loss, 0.5 draw (para p1)
+    outcome1 = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_matches_players_time", "p1_id", "p2_id", "played_at"),
+        # Historial de partidas de una organización ordenado por fecha
+        Index("ix_matches_org_time", "org_id", "played_at"),
+    )
+
+def orm_init_db() -> None:
+    Base.metadata.create_all(ENGINE)
+    # create_all no agrega índices nuevos a tablas que ya existían
+    insp = inspect(ENGINE)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {ix["name"] for ix in insp.get_indexes(table.name)}
+        missing.extend(ix for ix in table.indexes if ix.name not in existing)
+    if not missing:
+        return
+    if ENGINE.dialect.name == "postgresql":
+        # En Postgres se crean CONCURRENTLY (sin bloquear escrituras en tablas con datos);
+        # eso no puede ir dentro de una transacción, de ahí el AUTOCOMMIT
+        with ENGINE.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for ix in missing:
+                ddl = str(CreateIndex(ix).compile(dialect=ENGINE.dialect))
+                conn.exec_driver_sql(re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl))
+    else:
+        for ix in missing:
+            ix.create(ENGINE)
+
+def orm_get_or_create_org(name: str = "TimeSplit League") -> int:
+    with SessionLocal() as db:
+        org_id = db.execute(select(OrganizationORM.id).where(OrganizationORM.name == name)).scalar_one_or_none()
+        if org_id is not None:
+            return org_id
+        org = OrganizationORM(name=name)
+        db.add(org)
+        db.commit()
+        db.refresh(org)
+        return org.id
+
+# Los helpers de escritura aceptan una sesión `db` opcional: sin ella abren la suya y
+# hacen commit; con ella solo hacen flush y el commit queda a cargo de quien llama.
+
+def _get_or_create_player(db: Session, org_id: int, name: str, is_bot: bool) -> Tuple[PlayerORM, bool]:
+    """
+    Devuelve (jugador, creado); solo hace flush.
+    """
+    p = db.execute(lambda_stmt(
+        lambda: select(PlayerORM).where(PlayerORM.org_id == org_id, PlayerORM.name == name)
+    )).scalar_one_or_none()
+    if p:
+        return p, False
+    p = PlayerORM(org_id=org_id, name=name, is_bot=is_bot, rating=1500.0, rd=350.0, vol=0.06)
+    db.add(p)
+    db.flush()
+    return p, True
+
+def orm_get_or_create_player(org_id: int, name: str, is_bot: bool, db: Optional[Session] = None) -> PlayerORM:
+    if db is not None:
+        return _get_or_create_player(db, org_id, name, is_bot)[0]
+    # expire_on_commit=False: el jugador se devuelve ya cargado, sin un SELECT extra tras el commit
+    with SessionLocal(expire_on_commit=False) as db:
+        p, created = _get_or_create_player(db, org_id, name, is_bot)
+        db.commit()
+    # Como en orm_update_player(s)_glicko: invalida solo quien hace commit, y solo si hubo fila nueva
+    if created:
+        orm_invalidate_leaderboard()
+    return p
+
+def orm_ensure_bots(org_id: int, names: List[str]) -> None:
+    """
+    Crea de una vez (un SELECT + un INSERT multi-fila) los bots que aún no existen.
+    """
+    with SessionLocal() as db:
+        existing = set(db.execute(
+            select(PlayerORM.name).where(PlayerORM.org_id == org_id, PlayerORM.name.in_(names))
+        ).scalars())
+        missing = [n for n in dict.fromkeys(names) if n not in existing]
+        if not missing:
+            return
+        db.execute(insert(PlayerORM), [
+            {"org_id": org_id, "name": n, "is_bot": True, "rating": 1500.0, "rd": 350.0, "vol": 0.06}
+            for n in missing
+        ])
+        db.commit()
+    orm_invalidate_leaderboard()
+
+# Dialectos con INSERT ... ON CONFLICT; el resto usa get + add/update por ORM
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+def orm_save_session_with_splits(org_id: int, payload: Dict, db: Optional[Session] = None) -> None:
+    """
+    Inserta/actualiza GameSession por id y reemplaza splits.
+    """
+    if db is None:
+        with SessionLocal() as db:
+            orm_save_session_with_splits(org_id, payload, db=db)
+            db.commit()
+        return
+    sid = payload["id"]
+    vals = {
+        "player_name": payload["player"],
+        "mode": payload["mode"],
+        "started_at": int(payload["startedAt"]),
+        "duration_ms": int(payload["durationMs"]),
+        "total_score": float(payload["totalScore"]),
+    }
+    dialect_insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        # INSERT ... ON CONFLICT (id) DO UPDATE: una sentencia en vez de SELECT + INSERT/UPDATE
+        ins = dialect_insert(GameSessionORM).values(id=sid, org_id=org_id, **vals)
+        db.execute(ins.on_conflict_do_update(
+            index_elements=[GameSessionORM.id],
+            set_={k: ins.excluded[k] for k in vals},
+        ))
+        db.execute(delete(SplitORM).where(SplitORM.session_id == sid))
+    else:
+        ses = db.get(GameSessionORM, sid)
+        if not ses:
+            db.add(GameSessionORM(id=sid, org_id=org_id, **vals))
+        else:
+            for k, v in vals.items():
+                setattr(ses, k, v)
+            db.execute(delete(SplitORM).where(SplitORM.session_id == sid))
+        # La fila de la sesión tiene que existir antes de insertar splits (FK)
+        db.flush()
+
+    # Splits por Core: un executemany en lugar de un objeto ORM por marca
+    rows = [{"session_id": sid, "t_ms": int(sp["t"]), "lap": int(sp["lap"]),
+             "score": float(sp["score"]), "note": sp.get("note")}
+            for sp in payload.get("splits", [])]
+    if rows:
+        db.execute(insert(SplitORM.__table__), rows)
+
+def orm_save_match(org_id: int, session_id: str, mode: str, p1: PlayerORM, p2: PlayerORM,
+                   score1: float, score2: float, outcome1: float, db: Optional[Session] = None) -> str:
+    if db is None:
+        with SessionLocal() as db:
+            mid = orm_save_match(org_id, session_id, mode, p1, p2, score1, score2, outcome1, db=db)
+            db.commit()
+        return mid
+    mid = f"m_{uuid.uuid4().hex[:10]}"
+    db.add(MatchORM(
+        id=mid,
+        org_id=org_id,
+        played_at=int(time.time() * 1000),
+        mode=mode,
+        session_id=session_id,
+        p1_id=p1.id,
+        p2_id=p2.id,
+        score1=float(score1),
+        score2=float(score2),
+        outcome1=float(outcome1),
+    ))
+    db.flush()
+    return mid
+
+def orm_update_player_glicko(pid: int, rating: float, rd: float, vol: float, db: Optional[Session] = None) -> None:
+    if db is None:
+        with SessionLocal() as db:
+            orm_update_player_glicko(pid, rating, rd, vol, db=db)
+            db.commit()
+        orm_invalidate_leaderboard()
+        return
+    # UPDATE directo por id: sin SELECT previo ni detección de cambios del ORM
+    db.execute(
+        update(PlayerORM).where(PlayerORM.id == pid)
+        .values(rating=float(rating), rd=float(rd), vol=float(vol))
+    )
+
+def orm_update_players_glicko(rows: List[Tuple[int, float, float, float]], db: Optional[Session] = None) -> None:
+    """
+    Igual que orm_update_player_glicko para varios jugadores (pid, rating, rd, vol) en un executemany.
+    """
+    if db is None:
+        with SessionLocal() as db:
+            orm_update_players_glicko(rows, db=db)
+            db.commit()
+        orm_invalidate_leaderboard()
+        return
+    if rows:
+        db.execute(update(PlayerORM), [
+            {"id": pid, "rating": float(r), "rd": float(rd), "vol": float(vol)} for pid, r, rd, vol in rows
+        ])
+
+# Cache en proceso del ranking: se lee en cada frame pero solo cambia al guardar partidas
+LEADERBOARD_TTL_S = 60.0
+_leaderboard_cache: Dict[Tuple[int, int], Tuple[float, List[Dict]]] = {}
+# El ranking se consulta desde el hilo tsr-rank y se invalida desde el de guardado:
+# la generación evita que una lectura iniciada antes de invalidar vuelva a guardar filas viejas
+_leaderboard_lock = threading.Lock()
+_leaderboard_gen = 0
+
+def orm_invalidate_leaderboard() -> None:
+    global _leaderboard_gen
+    with _leaderboard_lock:
+        _leaderboard_gen += 1
+        _leaderboard_cache.clear()
+
+def orm_leaderboard_glicko(org_id: int, limit: int = 10) -> List[Dict]:
+    key = (org_id, limit)
+    now = time.monotonic()
+    with _leaderboard_lock:
+        hit = _leaderboard_cache.get(key)
+        gen = _leaderboard_gen
+    if hit and now - hit[0] < LEADERBOARD_TTL_S:
+        return hit[1]
+    with SessionLocal() as db:
+        rows = db.execute(lambda_stmt(
+            lambda: select(PlayerORM.name, PlayerORM.rating, PlayerORM.rd, PlayerORM.vol)
+            .where(PlayerORM.org_id == org_id)
+            .order_by(PlayerORM.rating.desc())
+            .limit(limit)
+        )).all()
+        board = [{"player": r[0], "rating": float(r[1]), "rd": float(r[2]), "vol": float(r[3])} for r in rows]
+    with _leaderboard_lock:
+        if gen == _leaderboard_gen:
+            if len(_leaderboard_cache) >= 256:
+                _leaderboard_cache.clear()
+            _leaderboard_cache[key] = (now, board)
+    return board
@@ -1,25 +1,189 @@
-# glicko2.py
-import math
-
-TAU = 0.5
-MU = 1500
-PHI = 350
-SIGMA = 0.06
-
-def g(phi):
-    return 1 / math.sqrt(1 + 3 * phi**2 / math.pi**2)
-
-def E(mu, mu_j, phi_j):
-    return 1 / (1 + math.exp(-g(phi_j) * (mu - mu_j)))
-
-def update_rating(mu, phi, sigma, results):
-    v_inv = sum((g(pj)**2) * E(mu, muj, pj) * (1 - E(mu, muj, pj)) for muj, pj, _ in results)
-    v = 1 / v_inv
-
-    delta = v * sum(g(pj) * (s - E(mu, muj, pj)) for muj, pj, s in results)
-
-    phi_star = math.sqrt(phi**2 + sigma**2)
-    phi_new = 1 / math.sqrt((1 / phi_star**2) + (1 / v))
-    mu_new = mu + phi_new**2 * sum(g(pj) * (s - E(mu, muj, pj)) for muj, pj, s in results)
-
-    return mu_new, phi_new, sigma
+# glicko2.py
+import math
+from functools import lru_cache
+from math import exp as _exp, sqrt as _sqrt, log as _log, pi as _pi
+
+# --- numpy (opcional) ---
+try:
+    import numpy as np
+except Exception:
+    np = None  # type: ignore
+
+# --- numba (opcional) ---
+try:
+    from numba import njit
+except Exception:
+    njit = None  # type: ignore
+
+TAU = 0.5
+MU = 1500
+PHI = 350
+SIGMA = 0.06
+
+_G_K = 3.0 / (_pi * _pi)
+
+# Con pocos rivales (una partida del juego) el bucle escalar gana a armar arrays
+NP_MIN_RESULTS = 16
+
+# φj de cada rival no cambia dentro de un periodo de rating
+@lru_cache(maxsize=4096)
+def g(phi):
+    return 1.0 / _sqrt(1.0 + _G_K * phi * phi)
+
+def E(mu, mu_j, phi_j):
+    return 1.0 / (1.0 + _exp(-g(phi_j) * (mu - mu_j)))
+
+def _glicko_f(x, delta, phi, v, a, tau):
+    # f(x) del paso 5 de Glickman; función de módulo, sin celdas de closure
+    ex = _exp(x)
+    phi2_v = phi * phi + v
+    d = phi2_v + ex
+    return ex * (delta * delta - phi2_v - ex) / (2.0 * d * d) - (x - a) / (tau * tau)
+
+def _new_sigma(delta, phi, v, sigma, tau=TAU, eps=1e-9, max_iter=60):
+    # Paso 5 de Glickman: resolver f(x) = 0 con x = ln σ'² (método Illinois).
+    a = _log(sigma * sigma)
+    f = _glicko_f
+
+    A = a
+    if delta * delta > phi * phi + v:
+        # Caso habitual: la cota B es cerrada y no hace falta la búsqueda hacia abajo
+        B = _log(delta * delta - phi * phi - v)
+    else:
+        B = a - tau
+        while f(B, delta, phi, v, a, tau) < 0:
+            B -= tau
+
+    fA = f(A, delta, phi, v, a, tau)
+    fB = f(B, delta, phi, v, a, tau)
+    for _ in range(max_iter):
+        if abs(B - A) <= eps:
+            break
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C, delta, phi, v, a, tau)
+        if abs(fC) < 1e-10:
+            # Raíz encontrada: no hace falta seguir cerrando el intervalo
+            A = C
+            break
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2.0
+        B, fB = C, fC
+    return _exp(A / 2.0)
+
+def _finish(mu, phi, sigma, v_inv, delta_sum, tau=TAU):
+    v = 1 / v_inv
+    sigma_new = _new_sigma(v * delta_sum, phi, v, sigma, tau)
+
+    phi_star2 = phi * phi + sigma_new * sigma_new
+    phi_new = 1 / _sqrt((1 / phi_star2) + (1 / v))
+    mu_new = mu + phi_new * phi_new * delta_sum
+
+    return mu_new, phi_new, sigma_new
+
+def _update_rating_py(mu, phi, sigma, results, tau=TAU):
+    # Σg(φj)(sj−E) aparece en Δ y en μ'; se acumula una sola vez junto a v.
+    # fsum: suma sin pérdida de precisión aunque haya muchos rivales
+    v_terms = []
+    d_terms = []
+    for muj, pj, s in results:
+        gj = g(pj)
+        Ej = 1.0 / (1.0 + _exp(-gj * (mu - muj)))
+        v_terms.append(gj * gj * Ej * (1 - Ej))
+        d_terms.append(gj * (s - Ej))
+    return _finish(mu, phi, sigma, math.fsum(v_terms), math.fsum(d_terms), tau)
+
+def _sums_kernel(mu, mu_j, phi_j, s):
+    v_inv = 0.0
+    delta_sum = 0.0
+    for j in range(len(mu_j)):
+        gj = 1.0 / math.sqrt(1.0 + 3.0 * phi_j[j] * phi_j[j] / (math.pi * math.pi))
+        Ej = 1.0 / (1.0 + math.exp(-gj * (mu - mu_j[j])))
+        v_inv += gj * gj * Ej * (1.0 - Ej)
+        delta_sum += gj * (s[j] - Ej)
+    return v_inv, delta_sum
+
+if njit is not None and np is not None:
+    _sums_kernel = njit(cache=True, fastmath=True)(_sums_kernel)
+
+def update_rating(mu, phi, sigma, results, tau=TAU):
+    if len(results) == 1:
+        # Caso de una partida (el que usa el juego): cuentas en línea, sin listas ni caché de g
+        muj, pj, s = results[0]
+        gj = 1.0 / _sqrt(1.0 + _G_K * pj * pj)
+        Ej = 1.0 / (1.0 + _exp(-gj * (mu - muj)))
+        return _finish(mu, phi, sigma, gj * gj * Ej * (1.0 - Ej), gj * (s - Ej), tau)
+    if np is None or len(results) < NP_MIN_RESULTS:
+        return _update_rating_py(mu, phi, sigma, results, tau)
+
+    arr = np.asarray(results, dtype=np.float64).reshape(-1, 3)
+    if njit is not None:
+        v_inv, delta_sum = _sums_kernel(
+            float(mu),
+            np.ascontiguousarray(arr[:, 0]),
+            np.ascontiguousarray(arr[:, 1]),
+            np.ascontiguousarray(arr[:, 2]),
+        )
+        return _finish(mu, phi, sigma, v_inv, delta_sum, tau)
+
+    # Una sola pasada vectorial: g y E se calculan una vez por rival
+    mu_j, phi_j, s = arr[:, 0], arr[:, 1], arr[:, 2]
+    g_vec = 1.0 / np.sqrt(1.0 + 3.0 * phi_j * phi_j / (np.pi * np.pi))
+    E_vec = 1.0 / (1.0 + np.exp(-g_vec * (mu - mu_j)))
+    v_inv = float(np.dot(g_vec * g_vec, E_vec * (1.0 - E_vec)))
+    delta_sum = float(np.dot(g_vec, s - E_vec))
+    return _finish(mu, phi, sigma, v_inv, delta_sum, tau)
+
+def update_ratings_period(mu, phi, sigma, opponents_mu, opponents_phi, scores, mask):
+    """
+    Actualiza N jugadores de un periodo de rating a la vez.
+    opponents_mu/opponents_phi/scores/mask tienen forma (N, M); mask marca
+    los rivales válidos de cada fila (el resto es relleno y se ignora).
+    Un jugador sin partidas conserva mu y sigma, y su phi crece a sqrt(phi² + sigma²).
+    """
+    if np is None:
+        mu_out, phi_out, sigma_out = [], [], []
+        for i in range(len(mu)):
+            v_inv = 0.0
+            delta_sum = 0.0
+            for muj, pj, s, ok in zip(opponents_mu[i], opponents_phi[i], scores[i], mask[i]):
+                if not ok:
+                    continue
+                gj = g(pj)
+                Ej = 1.0 / (1.0 + _exp(-gj * (mu[i] - muj)))
+                v_inv += gj * gj * Ej * (1 - Ej)
+                delta_sum += gj * (s - Ej)
+            if v_inv > 0:
+                mu_new, phi_new, sigma_new = _finish(mu[i], phi[i], sigma[i], v_inv, delta_sum)
+            else:
+                mu_new, phi_new, sigma_new = mu[i], _sqrt(phi[i] * phi[i] + sigma[i] * sigma[i]), sigma[i]
+            mu_out.append(mu_new)
+            phi_out.append(phi_new)
+            sigma_out.append(sigma_new)
+        return mu_out, phi_out, sigma_out
+
+    mu = np.asarray(mu, dtype=np.float64)
+    phi = np.asarray(phi, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    mu_j = np.asarray(opponents_mu, dtype=np.float64)
+    phi_j = np.asarray(opponents_phi, dtype=np.float64)
+    s = np.asarray(scores, dtype=np.float64)
+    m = np.asarray(mask, dtype=bool)
+
+    g_mat = 1.0 / np.sqrt(1.0 + 3.0 * phi_j * phi_j / (np.pi * np.pi))
+    E_mat = 1.0 / (1.0 + np.exp(-g_mat * (mu[:, None] - mu_j)))
+    v_inv = np.where(m, g_mat * g_mat * E_mat * (1.0 - E_mat), 0.0).sum(axis=1)
+    delta_sum = np.where(m, g_mat * (s - E_mat), 0.0).sum(axis=1)
+
+    # La volatilidad es una búsqueda de raíz escalar por jugador con partidas
+    sigma_new = sigma.copy()
+    for i in np.flatnonzero(v_inv > 0):
+        v = 1.0 / v_inv[i]
+        sigma_new[i] = _new_sigma(v * delta_sum[i], phi[i], v, sigma[i])
+
+    # 1/v == v_inv, así que las filas sin rivales (v_inv == 0) no dividen por cero
+    phi_star2 = phi * phi + sigma_new * sigma_new
+    phi_new = 1.0 / np.sqrt(1.0 / phi_star2 + v_inv)
+    mu_new = mu + phi_new * phi_new * delta_sum
+    return mu_new, phi_new, sigma_new
@@ -1,960 +1,1157 @@
-# timesplit_game.py — TimeSplit (Dragoncito Edition) + PostgreSQL (SQLAlchemy) + Glicko-2
-# --------------------------------------------------------------------------------------
-# - Juego simple (Carreras y Fútbol) que registra "splits" (marcas) en fracciones de tiempo (ms)
-# - Perso principal + bots + Dragoncito con sprite assets/dragon.png (si existe)
-# - Guarda sesiones, splits, jugadores, matches y ratings Glicko-2 en PostgreSQL
-# - Lee DATABASE_URL desde .env (python-dotenv). Si no existe, cae a SQLite local.
-#
-# Controles:
-#   Menú: ↑/↓ navega · ENTER elegir · 1..6 personaje · M mute · ESC salir
-#   Juego: ENTER nueva · ESPACIO pausa · R reiniciar · TAB cambia modo · L vuelta/periodo
-#          [ y ] tick (50–1000 ms) · - y + duración (modo)
-#   Carreras: ↑/↓ velocidad
-#   Fútbol: Flechas moverse · F chutar
-#   Guardado: S guardar (DB) · E CSV · X Excel (sesión) · U sync API (opcional)
-#
-# Requisitos (requirements.txt recomendado):
-#   pygame-ce
-#   SQLAlchemy
-#   psycopg2-binary
-#   python-dotenv
-#   requests
-#   openpyxl
-#
-# Nota: Si instalas con Python 3.13 en Windows, usa pygame-ce (evita compilación local).
-
-from __future__ import annotations
-
-import os
-import csv
-import time
-import uuid
-import math
-import random
-import re
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
-
-# --- cargar .env (si existe) ---
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    pass
-
-# --- pygame ---
-import pygame as pg
-
-# --- requests (opcional) ---
-try:
-    import requests
-except Exception:
-    requests = None  # type: ignore
-
-# --- excel export (opcional) ---
-try:
-    import openpyxl
-    from openpyxl.utils import get_column_letter
-except Exception:
-    openpyxl = None  # type: ignore
-
-# --- SQLAlchemy ---
-from sqlalchemy import (
-    create_engine, Column, Integer, Float, String, Text, Boolean,
-    ForeignKey, UniqueConstraint, Index, select
-)
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-
-# ======================================================================================
-# DB / ORM
-# ======================================================================================
-
-Base = declarative_base()
-
-def _db_url() -> str:
-    # Prioridad: DATABASE_URL (ideal para Postgres). Si no, SQLite local.
-    url = (os.getenv("DATABASE_URL") or "").strip()
-    if url:
-        return url
-    return "sqlite:///timesplit.sqlite"
-
-ENGINE = create_engine(_db_url(), echo=False, future=True)
-SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, autocommit=False, future=True)
-
-class OrganizationORM(Base):
-    __tablename__ = "organizations"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    name = Column(String, unique=True, nullable=False)
-
-    players = relationship("PlayerORM", back_populates="organization")
-
-class PlayerORM(Base):
-    __tablename__ = "players"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
-    name = Column(String, nullable=False, index=True)
-    is_bot = Column(Boolean, default=False, nullable=False)
-
-    # Glicko-2 params almacenados en escala "rating" (tipo Elo), RD y volatility
-    rating = Column(Float, default=1500.0, nullable=False)  # r
-    rd = Column(Float, default=350.0, nullable=False)       # RD
-    vol = Column(Float, default=0.06, nullable=False)       # sigma
-
-    organization = relationship("OrganizationORM", back_populates="players")
-
-    __table_args__ = (UniqueConstraint("org_id", "name", name="uix_org_playername"),)
-
-class GameSessionORM(Base):
-    __tablename__ = "game_sessions"
-    id = Column(String, primary_key=True)                 # uid
-    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
-    player_name = Column(String, nullable=False)
-    mode = Column(String, nullable=False)                 # "carreras" | "futbol"
-    started_at = Column(Integer, nullable=False)          # epoch ms
-    duration_ms = Column(Integer, nullable=False)
-    total_score = Column(Float, nullable=False)
-
-    splits = relationship("SplitORM", cascade="all, delete-orphan", back_populates="session")
-
-class SplitORM(Base):
-    __tablename__ = "splits"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String, ForeignKey("game_sessions.id", ondelete="CASCADE"), index=True)
-    t_ms = Column(Integer, nullable=False)
-    lap = Column(Integer, nullable=False)
-    score = Column(Float, nullable=False)
-    note = Column(Text, nullable=True)
-
-    session = relationship("GameSessionORM", back_populates="splits")
-    __table_args__ = (Index("ix_splits_session_t", "session_id", "t_ms"),)
-
-class MatchORM(Base):
-    __tablename__ = "matches"
-    id = Column(String, primary_key=True)                 # uid
-    org_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
-    played_at = Column(Integer, nullable=False)           # epoch ms
-
-    mode = Column(String, nullable=False)
-    session_id = Column(String, ForeignKey("game_sessions.id", ondelete="SET NULL"), nullable=True)
-
-    p1_id = Column(Integer, ForeignKey("players.id", ondelete="CASCADE"), nullable=False, index=True)
-    p2_id = Column(Integer, ForeignKey("players.id", ondelete="CASCADE"), nullable=False, index=True)
-
-    score1 = Column(Float, nullable=False)
-    score2 = Column(Float, nullable=False)
-
-    # outcome1: 1 win, 0 loss, 0.5 draw (para p1)
-    outcome1 = Column(Float, nullable=False)
-
-    __table_args__ = (Index("ix_matches_players_time", "p1_id", "p2_id", "played_at"),)
-
-def orm_init_db() -> None:
-    Base.metadata.create_all(ENGINE)
-
-def orm_get_or_create_org(name: str = "TimeSplit League") -> int:
-    with SessionLocal() as db:
-        org = db.execute(select(OrganizationORM).where(OrganizationORM.name == name)).scalar_one_or_none()
-        if org:
-            return org.id
-        org = OrganizationORM(name=name)
-        db.add(org)
-        db.commit()
-        db.refresh(org)
-        return org.id
-
-def orm_get_or_create_player(org_id: int, name: str, is_bot: bool) -> PlayerORM:
-    with SessionLocal() as db:
-        p = db.execute(
-            select(PlayerORM).where(PlayerORM.org_id == org_id, PlayerORM.name == name)
-        ).scalar_one_or_none()
-        if p:
-            return p
-        p = PlayerORM(org_id=org_id, name=name, is_bot=is_bot, rating=1500.0, rd=350.0, vol=0.06)
-        db.add(p)
-        db.commit()
-        db.refresh(p)
-        return p
-
-def orm_save_session_with_splits(org_id: int, payload: Dict) -> None:
-    """
-    Inserta/actualiza GameSession por id y reemplaza splits.
-    """
-    with SessionLocal() as db:
-        sid = payload["id"]
-        ses = db.get(GameSessionORM, sid)
-        if not ses:
-            ses = GameSessionORM(
-                id=sid,
-                org_id=org_id,
-                player_name=payload["player"],
-                mode=payload["mode"],
-                started_at=int(payload["startedAt"]),
-                duration_ms=int(payload["durationMs"]),
-                total_score=float(payload["totalScore"]),
-            )
-            db.add(ses)
-        else:
-            ses.player_name = payload["player"]
-            ses.mode = payload["mode"]
-            ses.started_at = int(payload["startedAt"])
-            ses.duration_ms = int(payload["durationMs"])
-            ses.total_score = float(payload["totalScore"])
-            ses.splits.clear()
-
-        for sp in payload.get("splits", []):
-            ses.splits.append(SplitORM(
-                session_id=sid,
-                t_ms=int(sp["t"]),
-                lap=int(sp["lap"]),
-                score=float(sp["score"]),
-                note=sp.get("note"),
-            ))
-        db.commit()
-
-def orm_save_match(org_id: int, session_id: str, mode: str, p1: PlayerORM, p2: PlayerORM,
-                   score1: float, score2: float, outcome1: float) -> str:
-    mid = f"m_{uuid.uuid4().hex[:10]}"
-    with SessionLocal() as db:
-        m = MatchORM(
-            id=mid,
-            org_id=org_id,
-            played_at=int(time.time() * 1000),
-            mode=mode,
-            session_id=session_id,
-            p1_id=p1.id,
-            p2_id=p2.id,
-            score1=float(score1),
-            score2=float(score2),
-            outcome1=float(outcome1),
-        )
-        db.add(m)
-        db.commit()
-    return mid
-
-def orm_update_player_glicko(pid: int, rating: float, rd: float, vol: float) -> None:
-    with SessionLocal() as db:
-        p = db.get(PlayerORM, pid)
-        if not p:
-            return
-        p.rating = float(rating)
-        p.rd = float(rd)
-        p.vol = float(vol)
-        db.commit()
-
-def orm_leaderboard_glicko(org_id: int, limit: int = 10) -> List[Dict]:
-    with SessionLocal() as db:
-        rows = db.execute(
-            select(PlayerORM.name, PlayerORM.rating, PlayerORM.rd, PlayerORM.vol)
-            .where(PlayerORM.org_id == org_id)
-            .order_by(PlayerORM.rating.desc())
-            .limit(limit)
-        ).all()
-        return [{"player": r[0], "rating": float(r[1]), "rd": float(r[2]), "vol": float(r[3])} for r in rows]
-
-# ======================================================================================
-# Glicko-2
-# ======================================================================================
-
-GLICKO_SCALE = 173.7178
-
-def _g(phi: float) -> float:
-    return 1.0 / math.sqrt(1.0 + 3.0 * (phi ** 2) / (math.pi ** 2))
-
-def _E(mu: float, mu_j: float, phi_j: float) -> float:
-    return 1.0 / (1.0 + math.exp(-_g(phi_j) * (mu - mu_j)))
-
-def glicko2_update(
-    r: float, RD: float, sigma: float,
-    opps: List[Tuple[float, float, float]],
-    tau: float = 0.5
-) -> Tuple[float, float, float]:
-    mu = (r - 1500.0) / GLICKO_SCALE
-    phi = RD / GLICKO_SCALE
-
-    if not opps:
-        phi_star = math.sqrt(phi * phi + sigma * sigma)
-        return r, phi_star * GLICKO_SCALE, sigma
-
-    opp_mus = [((rj - 1500.0) / GLICKO_SCALE, RDj / GLICKO_SCALE, sj) for (rj, RDj, sj) in opps]
-
-    v_inv = 0.0
-    delta_sum = 0.0
-    for mu_j, phi_j, s_j in opp_mus:
-        E_ = _E(mu, mu_j, phi_j)
-        g_ = _g(phi_j)
-        v_inv += (g_ ** 2) * E_ * (1.0 - E_)
-        delta_sum += g_ * (s_j - E_)
-    v = 1.0 / v_inv
-    delta = v * delta_sum
-
-    a = math.log(sigma * sigma)
-
-    def f(x: float) -> float:
-        ex = math.exp(x)
-        num = ex * (delta * delta - phi * phi - v - ex)
-        den = 2.0 * (phi * phi + v + ex) ** 2
-        return (num / den) - ((x - a) / (tau * tau))
-
-    A = a
-    if delta * delta > (phi * phi + v):
-        B = math.log(delta * delta - phi * phi - v)
-    else:
-        k = 1
-        B = a - k * tau
-        while f(B) < 0:
-            k += 1
-            B = a - k * tau
-
-    fA = f(A)
-    fB = f(B)
-    for _ in range(60):
-        C = A + (A - B) * fA / (fB - fA)
-        fC = f(C)
-        if abs(fC) < 1e-10:
-            A = C
-            break
-        if fC * fB < 0:
-            A = B
-            fA = fB
-        else:
-            fA = fA / 2.0
-        B = C
-        fB = fC
-
-    sigma_prime = math.exp(A / 2.0)
-
-    phi_star = math.sqrt(phi * phi + sigma_prime * sigma_prime)
-    phi_prime = 1.0 / math.sqrt((1.0 / (phi_star * phi_star)) + (1.0 / v))
-    mu_prime = mu + (phi_prime * phi_prime) * delta_sum
-
-    r_prime = 1500.0 + mu_prime * GLICKO_SCALE
-    RD_prime = phi_prime * GLICKO_SCALE
-    return r_prime, RD_prime, sigma_prime
-
-def apply_single_match_glicko(p1: PlayerORM, p2: PlayerORM, outcome1: float, tau: float = 0.5):
-    r1, rd1, s1 = p1.rating, p1.rd, outcome1
-    r2, rd2, s2 = p2.rating, p2.rd, (1.0 - outcome1) if outcome1 in (0.0, 1.0) else 0.5
-    nr1, nrd1, nvol1 = glicko2_update(r1, rd1, p1.vol, [(r2, rd2, s1)], tau=tau)
-    nr2, nrd2, nvol2 = glicko2_update(r2, rd2, p2.vol, [(r1, rd1, s2)], tau=tau)
-    return (nr1, nrd1, nvol1), (nr2, nrd2, nvol2)
-
-# ======================================================================================
-# Juego
-# ======================================================================================
-
-WIDTH, HEIGHT = 960, 540
-FPS = 60
-ASSETS_DIR = "assets"
-
-def uid(prefix="s") -> str:
-    return f"{prefix}_{uuid.uuid4().hex[:10]}"
-
-def fmt_ms(ms: int) -> str:
-    s = ms // 1000
-    mm = s // 60
-    ss = s % 60
-    cs = (ms % 1000) // 10
-    return f"{mm:02d}:{ss:02d}.{cs:02d}"
-
-def safe_filename(text: str) -> str:
-    name = re.sub(r'[\\/:*?"<>|]+', "_", text)
-    return name.strip().strip(".")
-
-def load_img(name: str):
-    path = os.path.join(ASSETS_DIR, name)
-    if not os.path.exists(path):
-        return None
-    try:
-        return pg.image.load(path).convert_alpha()
-    except Exception:
-        return None
-
-def load_snd(name: str, volume: float = 0.6):
-    if not hasattr(pg, "mixer"):
-        return None
-    for candidate in (name, os.path.splitext(name)[0] + ".wav", os.path.splitext(name)[0] + ".ogg"):
-        path = os.path.join(ASSETS_DIR, candidate)
-        if os.path.exists(path):
-            try:
-                snd = pg.mixer.Sound(path)
-                snd.set_volume(volume)
-                return snd
-            except Exception:
-                continue
-    return None
-
-CHARACTERS = [
-    {"name": "Aqua",       "color": ( 60,200,255)},
-    {"name": "Lime",       "color": ( 80,220,120)},
-    {"name": "Rose",       "color": (235, 80,140)},
-    {"name": "Gold",       "color": (245,200, 40)},
-    {"name": "Violet",     "color": (170, 95,255)},
-    {"name": "Dragoncito", "color": (100,200,100)},
-]
-BOT_NAMES_RACE = ["Bot-Alpha", "Bot-Bravo", "Bot-Charlie", "Bot-Delta", "Bot-Echo"]
-BOT_NAMES_FOOT = ["Rival-1", "Rival-2", "Rival-3", "Compi-1", "Compi-2"]
-
-PU_TURBO  = "TURBO"
-PU_SHIELD = "ESCUDO"
-PU_FIRE   = "FIREBALL"
-PU_FREEZE = "FREEZE"
-PU_DRAGON = "DRAGON"
-
-@dataclass
-class Split:
-    t: int
-    score: float
-    lap: int
-    note: Optional[str] = None
-
-class Session:
-    def __init__(self, player: str, mode: str):
-        self.id = uid("s")
-        self.player = player or "Jugador/a"
-        self.mode = mode
-        self.startedAt = int(time.time() * 1000)
-        self.totalScore = 0.0
-        self.durationMs = 0
-        self.splits: List[Split] = []
-
-class Game:
-    def __init__(self):
-        orm_init_db()
-        self.org_id = orm_get_or_create_org("TimeSplit League")
-
-        pg.init()
-        pg.display.set_caption("TimeSplit — Dragoncito Edition (PostgreSQL + Glicko-2)")
-        self.screen = pg.display.set_mode((WIDTH, HEIGHT))
-        self.clock = pg.time.Clock()
-        self.font = pg.font.SysFont("consolas,arial", 18)
-        self.big = pg.font.SysFont("consolas,arial", 28, bold=True)
-
-        self.muted = False
-        try:
-            pg.mixer.init()
-        except Exception:
-            pass
-        self.snd_pick  = load_snd("s_pick.ogg", 0.7)  or load_snd("s_pick.wav", 0.7)
-        self.snd_shoot = load_snd("s_shoot.ogg", 0.7) or load_snd("s_shoot.wav", 0.7)
-        self.snd_goal  = load_snd("s_goal.ogg", 0.8)  or load_snd("s_goal.wav", 0.8)
-
-        self.dragon_img = load_img("dragon.png")
-
-        self.screen_state = "menu"
-        self.menu_idx = 0
-
-        self.player_name = os.getenv("TSR_PLAYER") or "Jugador/a"
-        self.player_character_idx = 5
-        self.mode = "carreras"
-        self.tick_ms = 200
-        self.target_duration_s = 60
-        self.half_duration_s = 45
-        self.api_url = os.getenv("TSR_API") or "http://localhost:3000/api/sessions"
-
-        self.running = False
-        self.paused = False
-        self.elapsed_ms = 0
-        self.score = 0.0
-        self.lap = 1
-        self.enemy_score = 0
-        self.last_tick = 0
-
-        self.session: Optional[Session] = None
-        self.last_saved_payload: Optional[dict] = None
-        self.message = ""
-        self.msg_until = 0
-
-        self.speed = 20.0
-        self.cars: List[dict] = []
-
-        self.player_pos = pg.Vector2(120, HEIGHT / 2)
-        self.ball_pos = pg.Vector2(WIDTH / 2, HEIGHT / 2)
-        self.ball_vel = pg.Vector2(0, 0)
-        self.npcs: List[dict] = []
-
-        self.powerups: List[dict] = []
-        self.active_pu: Dict[str, int] = {}
-        self.next_pu_spawn_ms = 2500
-
-        for bn in BOT_NAMES_RACE + BOT_NAMES_FOOT:
-            orm_get_or_create_player(self.org_id, bn, is_bot=True)
-
-    def info(self, text: str, ms: int = 2200):
-        self.message = text
-        self.msg_until = pg.time.get_ticks() + ms
-
-    def play_snd(self, snd):
-        if self.muted or snd is None:
-            return
-        try:
-            snd.play()
-        except Exception:
-            pass
-
-    def _init_race_bots(self):
-        lanes = [HEIGHT * 0.30, HEIGHT * 0.38, HEIGHT * 0.46, HEIGHT * 0.54, HEIGHT * 0.62]
-        random.shuffle(lanes)
-        self.cars = []
-
-        ch = CHARACTERS[self.player_character_idx % len(CHARACTERS)]
-        self.player_label = ch["name"]
-        self.player_color = ch["color"]
-
-        self.cars.append({
-            "name": f"{self.player_label} ({self.player_name})",
-            "color": self.player_color,
-            "x": 60, "y": lanes[0],
-            "speed": self.speed,
-            "dist": 0.0,
-            "is_player": True
-        })
-
-        for i in range(1, min(5, len(lanes))):
-            self.cars.append({
-                "name": BOT_NAMES_RACE[i - 1],
-                "color": (180, 180, 200) if i % 2 == 0 else (200, 150, 80),
-                "x": random.randint(20, 180),
-                "y": lanes[i],
-                "speed": random.uniform(12, 28),
-                "dist": 0.0,
-                "is_player": False
-            })
-
-    def _init_football_npcs(self):
-        self.npcs = []
-        for i in range(3):
-            self.npcs.append({
-                "name": BOT_NAMES_FOOT[i],
-                "color": (210, 80, 80),
-                "pos": pg.Vector2(random.randint(WIDTH // 2 + 40, WIDTH - 60), random.randint(60, HEIGHT - 60)),
-                "role": "rival"
-            })
-        for i in range(2):
-            self.npcs.append({
-                "name": BOT_NAMES_FOOT[3 + i],
-                "color": (80, 180, 250),
-                "pos": pg.Vector2(random.randint(60, WIDTH // 2 - 60), random.randint(60, HEIGHT - 60)),
-                "role": "ally"
-            })
-
-    def get_limit_ms(self) -> int:
-        if self.mode == "carreras":
-            return int(self.target_duration_s * 1000)
-        return int(2 * self.half_duration_s * 1000)
-
-    def start_session(self):
-        self.session = Session(self.player_name, self.mode)
-        self.running = True
-        self.paused = False
-        self.elapsed_ms = 0
-        self.score = 0.0
-        self.lap = 1
-        self.enemy_score = 0
-        self.last_tick = 0
-
-        self.powerups.clear()
-        self.active_pu.clear()
-        self.next_pu_spawn_ms = 2500
-
-        self.player_pos.update(120, HEIGHT / 2)
-        self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
-        self.ball_vel.update(0, 0)
-
-        self._init_race_bots()
-        self._init_football_npcs()
-
-        self.info("Sesión iniciada (ENTER nueva, ESPACIO pausa)")
-        orm_get_or_create_player(self.org_id, self.player_name, is_bot=False)
-
-    def _register_split_tick(self):
-        if not self.session:
-            return
-        self.session.splits.append(Split(t=int(self.elapsed_ms), score=round(self.score, 2), lap=int(self.lap)))
-
-    def register_event(self, note: str):
-        if not self.session:
-            return
-        self.session.splits.append(Split(t=int(self.elapsed_ms), score=round(self.score, 2), lap=int(self.lap), note=note))
-
-    def finish_session(self):
-        if not self.session:
-            return
-        self.running = False
-        limit = self.get_limit_ms()
-        self.session.totalScore = round(self.score, 2)
-        self.session.durationMs = max(self.elapsed_ms, limit)
-
-        payload = {
-            "id": self.session.id,
-            "player": self.session.player,
-            "mode": self.session.mode,
-            "startedAt": self.session.startedAt,
-            "durationMs": self.session.durationMs,
-            "totalScore": self.session.totalScore,
-            "splits": [{"t": s.t, "lap": s.lap, "score": s.score, "note": s.note} for s in self.session.splits],
-        }
-
-        orm_save_session_with_splits(self.org_id, payload)
-        self.last_saved_payload = payload
-        self._persist_match_and_update_glicko()
-        self.info("Guardado OK (DB) + Rating actualizado (Glicko-2)")
-
-    def _persist_match_and_update_glicko(self):
-        p1 = orm_get_or_create_player(self.org_id, self.player_name, is_bot=False)
-
-        if self.mode == "carreras":
-            bot = None
-            best_dist = -1.0
-            player_dist = 0.0
-            for c in self.cars:
-                if c.get("is_player"):
-                    player_dist = float(c.get("dist", 0.0))
-                else:
-                    if float(c.get("dist", 0.0)) > best_dist:
-                        best_dist = float(c.get("dist", 0.0))
-                        bot = c
-            if bot is None:
-                bot_name = BOT_NAMES_RACE[0]
-                bot_score = 0.0
-            else:
-                bot_name = bot["name"]
-                bot_score = best_dist
-            score1 = player_dist
-            score2 = bot_score
-            outcome1 = 0.5 if abs(score1 - score2) < 1e-9 else (1.0 if score1 > score2 else 0.0)
-        else:
-            bot_name = "Rival-1"
-            score1 = float(self.score)
-            score2 = float(self.enemy_score)
-            outcome1 = 0.5 if score1 == score2 else (1.0 if score1 > score2 else 0.0)
-
-        p2 = orm_get_or_create_player(self.org_id, bot_name, is_bot=True)
-
-        orm_save_match(self.org_id, self.session.id, self.mode, p1, p2, score1, score2, outcome1)
-        (nr1, nrd1, nvol1), (nr2, nrd2, nvol2) = apply_single_match_glicko(p1, p2, outcome1, tau=0.5)
-        orm_update_player_glicko(p1.id, nr1, nrd1, nvol1)
-        orm_update_player_glicko(p2.id, nr2, nrd2, nvol2)
-
-    def export_csv_last(self):
-        if not self.last_saved_payload:
-            self.info("No hay sesión guardada aún")
-            return
-        p = self.last_saved_payload
-        fname = f"timesplit_{safe_filename(p['mode'])}_{safe_filename(p['player'])}_{p['startedAt']}.csv"
-        header = ["player", "mode", "startedAt", "durationMs", "totalScore", "t(ms)", "lap/periodo", "score", "note"]
-        try:
-            with open(fname, "w", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow(header)
-                for sp in p.get("splits", []):
-                    w.writerow([p["player"], p["mode"], p["startedAt"], p["durationMs"], p["totalScore"],
-                                sp["t"], sp["lap"], sp["score"], sp.get("note") or ""])
-            self.info(f"CSV exportado: {fname}")
-        except Exception as e:
-            self.info(f"Error exportando CSV: {e}")
-
-    def export_xlsx_last(self):
-        if openpyxl is None:
-            self.info("Falta openpyxl (pip install openpyxl)")
-            return
-        if not self.last_saved_payload:
-            self.info("No hay sesión guardada aún")
-            return
-        p = self.last_saved_payload
-        fname = f"timesplit_{safe_filename(p['mode'])}_{safe_filename(p['player'])}_{p['startedAt']}.xlsx"
-        try:
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "splits"
-            ws.append(["player", "mode", "startedAt", "durationMs", "totalScore"])
-            ws.append([p["player"], p["mode"], p["startedAt"], p["durationMs"], p["totalScore"]])
-            ws.append([])
-            ws.append(["t(ms)", "lap/periodo", "score", "note"])
-            for sp in p.get("splits", []):
-                ws.append([sp["t"], sp["lap"], sp["score"], sp.get("note") or ""])
-            for col in range(1, 5):
-                ws.column_dimensions[get_column_letter(col)].width = 18
-            ws.column_dimensions[get_column_letter(4)].width = 28
-            wb.save(fname)
-            self.info(f"Excel exportado: {fname}")
-        except Exception as e:
-            self.info(f"Error exportando Excel: {e}")
-
-    def _spawn_powerup(self):
-        kinds = [PU_TURBO, PU_SHIELD, PU_FIRE, PU_FREEZE, PU_DRAGON]
-        self.powerups.append({"kind": random.choice(kinds),
-                              "pos": pg.Vector2(random.randint(120, WIDTH - 120), random.randint(90, HEIGHT - 90)),
-                              "t": self.elapsed_ms})
-
-    def _update_powerups(self):
-        if self.elapsed_ms >= self.next_pu_spawn_ms:
-            self._spawn_powerup()
-            self.next_pu_spawn_ms += random.randint(2200, 4200)
-        pickup_radius = 22
-        player_pos = self.player_pos if self.mode == "futbol" else pg.Vector2(140, self.cars[0]["y"] if self.cars else HEIGHT/2)
-        new_list = []
-        for pu in self.powerups:
-            if pu["pos"].distance_to(player_pos) <= pickup_radius:
-                self.play_snd(self.snd_pick)
-                self.active_pu[pu["kind"]] = self.elapsed_ms + 3500
-                self.register_event(f"PICK {pu['kind']}")
-            else:
-                new_list.append(pu)
-        self.powerups = new_list
-        for k in list(self.active_pu.keys()):
-            if self.elapsed_ms >= self.active_pu[k]:
-                del self.active_pu[k]
-
-    def _update_carreras(self, dt_ms: int):
-        speed = self.speed * (1.35 if PU_TURBO in self.active_pu else 1.0)
-        if self.cars:
-            self.cars[0]["speed"] = speed
-        for c in self.cars:
-            c["dist"] += float(c["speed"]) * (dt_ms / 1000.0)
-            c["x"] = 60 + (c["dist"] * 10) % (WIDTH - 140)
-        if self.cars:
-            self.score = float(self.cars[0]["dist"])
-
-    def _update_futbol(self, dt_ms: int):
-        self.ball_pos += self.ball_vel * (dt_ms / 16.0)
-        self.ball_vel *= 0.992
-        if self.ball_pos.y < 18 or self.ball_pos.y > HEIGHT - 18:
-            self.ball_vel.y *= -1
-        if self.ball_pos.x < 18 or self.ball_pos.x > WIDTH - 18:
-            self.ball_vel.x *= -1
-
-        for npc in self.npcs:
-            to_ball = self.ball_pos - npc["pos"]
-            if to_ball.length() > 1:
-                to_ball.scale_to_length(0.7 if npc["role"] == "rival" else 0.45)
-                npc["pos"] += to_ball
-
-        goal_top, goal_bot = int(HEIGHT * 0.35), int(HEIGHT * 0.65)
-        if self.ball_pos.x <= 10 and goal_top <= self.ball_pos.y <= goal_bot:
-            self.enemy_score += 1
-            self.play_snd(self.snd_goal)
-            self.register_event("GOAL EN CONTRA")
-            self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
-            self.ball_vel.update(0, 0)
-        if self.ball_pos.x >= WIDTH - 10 and goal_top <= self.ball_pos.y <= goal_bot:
-            self.score += 1
-            self.play_snd(self.snd_goal)
-            self.register_event("GOAL A FAVOR")
-            self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
-            self.ball_vel.update(0, 0)
-
-    def _draw_hud(self):
-        pg.draw.rect(self.screen, (15, 18, 30), (0, 0, WIDTH, 58))
-        t = self.font.render(f"Modo: {self.mode} | Tick: {self.tick_ms}ms | Duración objetivo: {self.get_limit_ms()//1000}s", True, (220, 230, 255))
-        self.screen.blit(t, (14, 10))
-        t2 = self.big.render(f"{fmt_ms(self.elapsed_ms)}", True, (255, 255, 255))
-        self.screen.blit(t2, (14, 28))
-        if self.mode == "carreras":
-            s = self.big.render(f"Puntaje(dist): {self.score:.2f} | Vuelta: {self.lap}", True, (200, 255, 200))
-        else:
-            s = self.big.render(f"Goles: {int(self.score)} (Rivales {self.enemy_score}) | Periodo: {self.lap}", True, (200, 255, 200))
-        self.screen.blit(s, (250, 26))
-        if self.active_pu:
-            active = " ".join(list(self.active_pu.keys()))
-            ptxt = self.font.render(f"Power-ups: {active}", True, (255, 210, 120))
-            self.screen.blit(ptxt, (14, 56))
-        if self.message and pg.time.get_ticks() < self.msg_until:
-            msg = self.font.render(self.message, True, (255, 220, 220))
-            self.screen.blit(msg, (14, HEIGHT - 24))
-
-    def _draw_carreras(self):
-        pg.draw.rect(self.screen, (30, 30, 35), (0, int(HEIGHT * 0.22), WIDTH, int(HEIGHT * 0.56)))
-        pg.draw.line(self.screen, (240, 240, 240), (0, HEIGHT // 2), (WIDTH, HEIGHT // 2), 3)
-        pg.draw.rect(self.screen, (220, 40, 80), (WIDTH - 18, int(HEIGHT * 0.22), 18, int(HEIGHT * 0.56)))
-        for c in self.cars:
-            x = int(c["x"]); y = int(c["y"])
-            if c.get("is_player") and self.player_label == "Dragoncito" and self.dragon_img is not None:
-                img = pg.transform.smoothscale(self.dragon_img, (52, 52))
-                self.screen.blit(img, (x, y - 26))
-            else:
-                pg.draw.rect(self.screen, c["color"], (x, y - 18, 44, 36), border_radius=6)
-            name = self.font.render(c["name"], True, (220, 220, 220))
-            self.screen.blit(name, (x + 50, y - 10))
-        for pu in self.powerups:
-            pg.draw.circle(self.screen, (255, 210, 120), (int(pu["pos"].x), int(pu["pos"].y)), 10)
-
-    def _draw_futbol(self):
-        self.screen.fill((10, 120, 70))
-        pg.draw.rect(self.screen, (255, 255, 255), (12, 76, WIDTH - 24, HEIGHT - 120), 2)
-        pg.draw.line(self.screen, (255, 255, 255), (WIDTH // 2, 76), (WIDTH // 2, HEIGHT - 44), 2)
-        pg.draw.circle(self.screen, (255, 255, 255), (WIDTH // 2, HEIGHT // 2 + 16), 42, 2)
-        goal_top, goal_bot = int(HEIGHT * 0.35), int(HEIGHT * 0.65)
-        pg.draw.rect(self.screen, (255, 255, 255), (0, goal_top, 12, goal_bot - goal_top), 2)
-        pg.draw.rect(self.screen, (255, 255, 255), (WIDTH - 12, goal_top, 12, goal_bot - goal_top), 2)
-        ch = CHARACTERS[self.player_character_idx % len(CHARACTERS)]
-        if ch["name"] == "Dragoncito" and self.dragon_img is not None:
-            img = pg.transform.smoothscale(self.dragon_img, (52, 52))
-            self.screen.blit(img, (int(self.player_pos.x - 26), int(self.player_pos.y - 26)))
-        else:
-            pg.draw.circle(self.screen, ch["color"], (int(self.player_pos.x), int(self.player_pos.y)), 12)
-        for npc in self.npcs:
-            pg.draw.circle(self.screen, npc["color"], (int(npc["pos"].x), int(npc["pos"].y)), 10)
-        pg.draw.circle(self.screen, (250, 250, 250), (int(self.ball_pos.x), int(self.ball_pos.y)), 7)
-        for pu in self.powerups:
-            pg.draw.circle(self.screen, (255, 210, 120), (int(pu["pos"].x), int(pu["pos"].y)), 10)
-
-    def _handle_menu_event(self, ev):
-        if ev.type != pg.KEYDOWN:
-            return
-        if ev.key == pg.K_ESCAPE:
-            raise SystemExit
-        if ev.key == pg.K_DOWN:
-            self.menu_idx = (self.menu_idx + 1) % 4
-        if ev.key == pg.K_UP:
-            self.menu_idx = (self.menu_idx - 1) % 4
-        if ev.key == pg.K_m:
-            self.muted = not self.muted
-            self.info("Mute ON" if self.muted else "Mute OFF")
-        if pg.K_1 <= ev.key <= pg.K_6:
-            self.player_character_idx = int(ev.unicode) - 1
-            self.info(f"Personaje: {CHARACTERS[self.player_character_idx]['name']}")
-        if ev.key == pg.K_RETURN:
-            if self.menu_idx == 0:
-                self.mode = "carreras"; self.start_session(); self.screen_state = "game"
-            elif self.menu_idx == 1:
-                self.mode = "futbol"; self.start_session(); self.screen_state = "game"
-            elif self.menu_idx == 2:
-                self.screen_state = "ranking"
-            else:
-                raise SystemExit
-
-    def _handle_game_event(self, ev):
-        if ev.type != pg.KEYDOWN:
-            return
-        if ev.key == pg.K_ESCAPE:
-            self.screen_state = "menu"; self.running = False; return
-        if ev.key == pg.K_SPACE:
-            self.paused = not self.paused; self.info("Pausa" if self.paused else "Reanudar")
-        if ev.key == pg.K_RETURN:
-            self.start_session()
-        if ev.key == pg.K_TAB:
-            self.mode = "futbol" if self.mode == "carreras" else "carreras"
-            self.start_session(); self.info(f"Modo: {self.mode}")
-        if ev.key == pg.K_r:
-            self.start_session()
-        if ev.key == pg.K_l:
-            self.lap = min(self.lap + 1, 99)
-            self.register_event("LAP/PERIODO")
-        if ev.key == pg.K_LEFTBRACKET:
-            self.tick_ms = max(50, self.tick_ms - 50); self.info(f"Tick: {self.tick_ms} ms")
-        if ev.key == pg.K_RIGHTBRACKET:
-            self.tick_ms = min(1000, self.tick_ms + 50); self.info(f"Tick: {self.tick_ms} ms")
-        if ev.key == pg.K_MINUS:
-            if self.mode == "carreras": self.target_duration_s = max(10, self.target_duration_s - 5)
-            else: self.half_duration_s = max(15, self.half_duration_s - 5)
-        if ev.key in (pg.K_PLUS, pg.K_EQUALS):
-            if self.mode == "carreras": self.target_duration_s = min(180, self.target_duration_s + 5)
-            else: self.half_duration_s = min(120, self.half_duration_s + 5)
-        if ev.key == pg.K_s:
-            self.finish_session()
-        if ev.key == pg.K_e:
-            self.export_csv_last()
-        if ev.key == pg.K_x:
-            self.export_xlsx_last()
-        if self.mode == "carreras":
-            if ev.key == pg.K_UP: self.speed = min(200.0, self.speed + 2.0)
-            if ev.key == pg.K_DOWN: self.speed = max(0.0, self.speed - 2.0)
-        else:
-            if ev.key == pg.K_f: self.shoot()
-
-    def shoot(self):
-        d = self.ball_pos - self.player_pos
-        dist = d.length()
-        if 0 < dist < 42:
-            power = 7.5 + random.random() * 5.0
-            d.scale_to_length(power * 20)
-            self.ball_vel = d
-            self.play_snd(self.snd_shoot)
-            self.register_event("SHOT")
-
-    def _draw_menu(self):
-        self.screen.fill((8, 10, 22))
-        title = self.big.render("TimeSplit — Dragoncito (Postgres + Glicko-2)", True, (240, 240, 255))
-        self.screen.blit(title, (40, 40))
-        subtitle = self.font.render("↑/↓ elegir · ENTER · 1..6 personaje · M mute", True, (190, 200, 230))
-        self.screen.blit(subtitle, (40, 78))
-        opts = ["Jugar Carreras", "Jugar Fútbol", "Ver Ranking (Glicko-2)", "Salir"]
-        y = 140
-        for i, o in enumerate(opts):
-            col = (255, 255, 255) if i == self.menu_idx else (170, 180, 210)
-            self.screen.blit(self.big.render(o, True, col), (70, y))
-            y += 54
-        ch = CHARACTERS[self.player_character_idx % len(CHARACTERS)]
-        p = self.font.render(f"Jugador: {self.player_name} | Personaje: {ch['name']} | DB: {'Postgres' if os.getenv('DATABASE_URL') else 'SQLite'}", True, (210, 210, 210))
-        self.screen.blit(p, (40, HEIGHT - 36))
-
-    def _draw_ranking(self):
-        self.screen.fill((10, 10, 18))
-        self.screen.blit(self.big.render("Ranking (Glicko-2) — TOP 10", True, (240, 240, 255)), (40, 36))
-        self.screen.blit(self.font.render("ESC volver al menú", True, (170, 180, 210)), (40, 66))
-        rows = orm_leaderboard_glicko(self.org_id, limit=10)
-        y = 120
-        self.screen.blit(self.font.render("Pos   Jugador                Rating    RD     Vol", True, (220, 220, 220)), (60, y))
-        y += 22
-        for idx, r in enumerate(rows, start=1):
-            line = f"{idx:>2}   {r['player'][:20]:<20}   {r['rating']:>7.1f}  {r['rd']:>6.1f}  {r['vol']:.4f}"
-            col = (200, 230, 200) if idx == 1 else (200, 200, 200)
-            self.screen.blit(self.font.render(line, True, col), (60, y))
-            y += 22
-
-    def run(self):
-        while True:
-            dt = self.clock.tick(FPS)
-            for ev in pg.event.get():
-                if ev.type == pg.QUIT:
-                    raise SystemExit
-                if self.screen_state == "menu":
-                    self._handle_menu_event(ev)
-                elif self.screen_state == "game":
-                    self._handle_game_event(ev)
-                elif self.screen_state == "ranking":
-                    if ev.type == pg.KEYDOWN and ev.key == pg.K_ESCAPE:
-                        self.screen_state = "menu"
-
-            if self.screen_state == "game" and self.running and not self.paused:
-                self.elapsed_ms += dt
-                self._update_powerups()
-                if self.mode == "carreras":
-                    self._update_carreras(dt)
-                else:
-                    keys = pg.key.get_pressed()
-                    v = pg.Vector2(0, 0)
-                    if keys[pg.K_UP]: v.y -= 1
-                    if keys[pg.K_DOWN]: v.y += 1
-                    if keys[pg.K_LEFT]: v.x -= 1
-                    if keys[pg.K_RIGHT]: v.x += 1
-                    if v.length() > 0:
-                        v = v.normalize() * (3.4 if PU_TURBO in self.active_pu else 2.6)
-                        self.player_pos += v
-                        self.player_pos.x = max(30, min(WIDTH - 30, self.player_pos.x))
-                        self.player_pos.y = max(90, min(HEIGHT - 60, self.player_pos.y))
-                    self._update_futbol(dt)
-
-                if self.elapsed_ms - self.last_tick >= self.tick_ms:
-                    self.last_tick = self.elapsed_ms
-                    self._register_split_tick()
-
-                if self.elapsed_ms >= self.get_limit_ms():
-                    self.finish_session()
-
-            if self.screen_state == "menu":
-                self._draw_menu()
-            elif self.screen_state == "ranking":
-                self._draw_ranking()
-            else:
-                if self.mode == "carreras":
-                    self.screen.fill((8, 10, 22))
-                    self._draw_carreras()
-                else:
-                    self._draw_futbol()
-                self._draw_hud()
-
-            pg.display.flip()
-
-if __name__ == "__main__":
-    Game().run()
+# timesplit_game.py — TimeSplit (Dragoncito Edition) + PostgreSQL (SQLAlchemy) + Glicko-2
+# --------------------------------------------------------------------------------------
+# - Juego simple (Carreras y Fútbol) que registra "splits" (marcas) en fracciones de tiempo (ms)
+# - Perso principal + bots + Dragoncito con sprite assets/dragon.png (si existe)
+# - Guarda sesiones, splits, jugadores, matches y ratings Glicko-2 en PostgreSQL
+# - Lee DATABASE_URL desde .env (python-dotenv). Si no existe, cae a SQLite local.
+#
+# Controles:
+#   Menú: ↑/↓ navega · ENTER elegir · 1..6 personaje · M mute · ESC salir
+#   Juego: ENTER nueva · ESPACIO pausa · R reiniciar · TAB cambia modo · L vuelta/periodo
+#          [ y ] tick (50–1000 ms) · - y + duración (modo)
+#   Carreras: ↑/↓ velocidad
+#   Fútbol: Flechas moverse · F chutar
+#   Guardado: S guardar (DB) · E CSV · X Excel (sesión) · U sync API (opcional)
+#   Con TSR_PROFILE=1: F1 imprime tiempos p50/p95/p99 (db, glicko, step, draw)
+#
+# Requisitos (requirements.txt recomendado):
+#   pygame-ce
+#   SQLAlchemy
+#   psycopg2-binary
+#   python-dotenv
+#   requests
+#   openpyxl
+#
+# Nota: Si instalas con Python 3.13 en Windows, usa pygame-ce (evita compilación local).
+
+from __future__ import annotations
+
+import os
+import csv
+import json
+import hashlib
+import heapq
+import time
+import secrets
+import math
+import array
+import random
+from functools import lru_cache
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Tuple
+
+# --- cargar .env (si existe) ---
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+# --- pygame ---
+import pygame as pg
+
+# --- requests (opcional) ---
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except Exception:
+    requests = None  # type: ignore
+
+# --- orjson (opcional, JSON más rápido para el sync) ---
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
+# --- excel export (opcional) ---
+try:
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+except Exception:
+    openpyxl = None  # type: ignore
+
+# --- DB / ORM (db.py) ---
+from db import (
+    SessionLocal, PlayerORM, orm_init_db, orm_get_or_create_org, orm_get_or_create_player, orm_ensure_bots,
+    orm_save_session_with_splits, orm_save_match, orm_update_players_glicko, orm_leaderboard_glicko,
+    orm_invalidate_leaderboard,
+)
+
+# --- Glicko-2 (glicko2.py): un único solver para el juego y el cálculo por lotes ---
+from glicko2 import update_rating
+
+# ======================================================================================
+# Glicko-2
+# ======================================================================================
+
+GLICKO_SCALE = 173.7178
+
+def glicko2_update(
+    r: float, RD: float, sigma: float,
+    opps: List[Tuple[float, float, float]],
+    tau: float = 0.5
+) -> Tuple[float, float, float]:
+    # Escala rating/RD <-> μ/φ; el cálculo en sí vive en glicko2.update_rating
+    phi = RD / GLICKO_SCALE
+    if not opps:
+        return r, math.sqrt(phi * phi + sigma * sigma) * GLICKO_SCALE, sigma
+    results = [((rj - 1500.0) / GLICKO_SCALE, RDj / GLICKO_SCALE, sj) for (rj, RDj, sj) in opps]
+    mu_p, phi_p, sigma_p = update_rating((r - 1500.0) / GLICKO_SCALE, phi, sigma, results, tau=tau)
+    return 1500.0 + mu_p * GLICKO_SCALE, phi_p * GLICKO_SCALE, sigma_p
+
+def apply_single_match_glicko(p1: PlayerORM, p2: PlayerORM, outcome1: float, tau: float = 0.5):
+    r1, rd1, s1 = p1.rating, p1.rd, outcome1
+    r2, rd2, s2 = p2.rating, p2.rd, (1.0 - outcome1) if outcome1 in (0.0, 1.0) else 0.5
+    nr1, nrd1, nvol1 = glicko2_update(r1, rd1, p1.vol, [(r2, rd2, s1)], tau=tau)
+    nr2, nrd2, nvol2 = glicko2_update(r2, rd2, p2.vol, [(r1, rd1, s2)], tau=tau)
+    return (nr1, nrd1, nvol1), (nr2, nrd2, nvol2)
+
+# ======================================================================================
+# Juego
+# ======================================================================================
+
+WIDTH, HEIGHT = 960, 540
+FPS = 60
+DIAG = math.sqrt(0.5)
+FIXED_DT_MS = 16      # paso fijo de la física
+# Las velocidades del fútbol (px, amortiguación) están pensadas "por frame" a 60 FPS:
+# cada paso las escala por dt / FRAME_REF_MS para que el ritmo no dependa del paso
+FRAME_REF_MS = 1000.0 / FPS
+MAX_FRAME_MS = 250    # tiempo real máximo que se simula por frame
+# Eventos tras los que el contenido de la ventana puede haberse perdido
+_REDRAW_EVENTS = frozenset((pg.VIDEOEXPOSE, pg.WINDOWEXPOSED, pg.WINDOWSHOWN, pg.WINDOWRESTORED))
+
+# Flechas como máscara de 4 bits (↑ ↓ ← →) -> dirección unitaria ya normalizada en diagonal
+def _build_dir_lut():
+    lut = []
+    for mask in range(16):
+        dx = ((mask >> 0) & 1) - ((mask >> 1) & 1)
+        dy = ((mask >> 2) & 1) - ((mask >> 3) & 1)
+        k = DIAG if dx and dy else 1.0
+        lut.append((dx * k, dy * k) if dx or dy else None)
+    return tuple(lut)
+
+_DIR_LUT = _build_dir_lut()
+ASSETS_DIR = "assets"
+# clave -> (archivo preferido, volumen); load_snd prueba también .wav/.ogg
+SOUNDS = {
+    "pick":  ("s_pick.ogg", 0.7),
+    "shoot": ("s_shoot.ogg", 0.7),
+    "goal":  ("s_goal.ogg", 0.8),
+}
+
+def uid(prefix="s") -> str:
+    return f"{prefix}_{secrets.token_hex(5)}"
+
+def fmt_ms(ms: int) -> str:
+    s, rem = divmod(ms, 1000)
+    mm, ss = divmod(s, 60)
+    return f"{mm:02d}:{ss:02d}.{rem // 10:02d}"
+
+# --- Medición opcional (TSR_PROFILE=1): tiempos por categoría, F1 imprime p50/p95/p99 ---
+PROFILE = os.getenv("TSR_PROFILE", "").strip().lower() not in ("", "0", "false", "no", "off")
+_timings: Dict[str, deque] = {}
+_NO_TIMING = nullcontext()
+
+@contextmanager
+def _timed(name: str):
+    t0 = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        buf = _timings.get(name)
+        if buf is None:
+            buf = _timings[name] = deque(maxlen=1024)
+        buf.append(time.perf_counter_ns() - t0)
+
+def timed(name: str):
+    return _timed(name) if PROFILE else _NO_TIMING
+
+def _percentile_ms(xs: List[int], q: float) -> float:
+    # xs ordenada, en ns
+    return xs[min(len(xs) - 1, int(q * len(xs)))] / 1e6
+
+def timing_report() -> List[str]:
+    lines = []
+    for name, buf in sorted(_timings.items()):
+        xs = sorted(buf)
+        p50, p95, p99 = (_percentile_ms(xs, q) for q in (0.50, 0.95, 0.99))
+        lines.append(f"{name:<8} n={len(xs):<5} p50={p50:.3f}ms p95={p95:.3f}ms p99={p99:.3f}ms")
+    return lines
+
+# Cada carácter prohibido pasa a "_" en una sola pasada de str.translate, sin regex
+_FN_TRANS = str.maketrans({c: "_" for c in '\\/:*?"<>|'})
+
+def safe_filename(text: str) -> str:
+    return text.translate(_FN_TRANS).strip().strip(".")
+
+# Una sola sesión HTTP para todo el proceso: reutiliza conexiones (keep-alive) entre syncs
+def _make_http_session():
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+_HTTP = _make_http_session() if requests is not None else None
+
+def dumps_json(obj) -> bytes:
+    # JSON compacto con claves ordenadas: mismo payload -> mismos bytes (sirve para el hash)
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def sync_to_api(body: bytes, url: str) -> Tuple[bool, str]:
+    if _HTTP is None:
+        return False, "Falta requests (pip install requests)"
+    try:
+        r = _HTTP.post(url, data=body, headers={"Content-Type": "application/json"}, timeout=10)
+        return r.ok, f"HTTP {r.status_code}"
+    except Exception as e:
+        return False, str(e)
+
+@lru_cache(maxsize=1)
+def _asset_names() -> frozenset:
+    # Un solo listdir de assets/ en vez de un stat por cada candidato
+    try:
+        return frozenset(os.listdir(ASSETS_DIR))
+    except OSError:
+        return frozenset()
+
+def remove_quiet(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def load_img(name: str):
+    if name not in _asset_names():
+        return None
+    path = os.path.join(ASSETS_DIR, name)
+    try:
+        return pg.image.load(path).convert_alpha()
+    except Exception:
+        return None
+
+def load_snd(name: str, volume: float = 0.6):
+    if not hasattr(pg, "mixer"):
+        return None
+    assets = _asset_names()
+    base = os.path.splitext(name)[0]
+    for candidate in (name, base + ".wav", base + ".ogg"):
+        if candidate in assets:
+            path = os.path.join(ASSETS_DIR, candidate)
+            try:
+                snd = pg.mixer.Sound(path)
+                snd.set_volume(volume)
+                return snd
+            except Exception:
+                continue
+    return None
+
+CHARACTERS = [
+    {"name": "Aqua",       "color": ( 60,200,255)},
+    {"name": "Lime",       "color": ( 80,220,120)},
+    {"name": "Rose",       "color": (235, 80,140)},
+    {"name": "Gold",       "color": (245,200, 40)},
+    {"name": "Violet",     "color": (170, 95,255)},
+    {"name": "Dragoncito", "color": (100,200,100)},
+]
+BOT_NAMES_RACE = ["Bot-Alpha", "Bot-Bravo", "Bot-Charlie", "Bot-Delta", "Bot-Echo"]
+BOT_NAMES_FOOT = ["Rival-1", "Rival-2", "Rival-3", "Compi-1", "Compi-2"]
+
+PU_TURBO  = "TURBO"
+PU_SHIELD = "ESCUDO"
+PU_FIRE   = "FIREBALL"
+PU_FREEZE = "FREEZE"
+PU_DRAGON = "DRAGON"
+
+class Session:
+    def __init__(self, player: str, mode: str):
+        self.id = uid("s")
+        self.player = player or "Jugador/a"
+        self.mode = mode
+        # Epoch en ms (se guarda en DB/CSV): reloj de pared, pero entero y sin pasar por float
+        self.startedAt = time.time_ns() // 1_000_000
+        self.totalScore = 0.0
+        self.durationMs = 0
+        # Splits en columnas paralelas (t, score, lap, note) en vez de un objeto por marca
+        self.split_t = array.array("i")
+        self.split_score = array.array("d")
+        self.split_lap = array.array("i")
+        self.split_note: List[Optional[str]] = []
+
+    def add_split(self, t: int, score: float, lap: int, note: Optional[str] = None):
+        self.split_t.append(t)
+        self.split_score.append(score)
+        self.split_lap.append(lap)
+        self.split_note.append(note)
+
+class Game:
+    def __init__(self):
+        orm_init_db()
+        self.org_id = orm_get_or_create_org("TimeSplit League")
+
+        pg.init()
+        pg.display.set_caption("TimeSplit — Dragoncito Edition (PostgreSQL + Glicko-2)")
+        self.screen = pg.display.set_mode((WIDTH, HEIGHT))
+        self.clock = pg.time.Clock()
+        # Solo se consumen QUIT, KEYDOWN y los eventos que obligan a repintar la ventana;
+        # SDL descarta el resto (ratón, joystick…) antes de la cola
+        pg.event.set_blocked(None)
+        pg.event.set_allowed([pg.QUIT, pg.KEYDOWN] + list(_REDRAW_EVENTS))
+        self.font = pg.font.SysFont("consolas,arial", 18)
+        self.big = pg.font.SysFont("consolas,arial", 28, bold=True)
+        self._text_cache: Dict[Tuple, pg.Surface] = {}
+        self._sprite_cache: Dict[Tuple, pg.Surface] = {}
+        # Líneas fijas del HUD; se rearman solo cuando algo de lo que muestran cambia
+        self._hud_lines: Tuple[str, Optional[str], Optional[str]] = ("", None, None)
+        self._hud_dirty = True
+        self._static_dirty = True
+        self._clock_cs = -1
+        self._clock_surf: Optional[pg.Surface] = None
+        self._dist_text = ""
+        self._dist_surf: Optional[pg.Surface] = None
+
+        self.muted = False
+        try:
+            pg.mixer.init()
+        except Exception:
+            pass
+        # Sonidos e imágenes se cargan al primer uso (o al empezar sesión), no al abrir el menú
+        self._snd_cache: Dict[str, Optional["pg.mixer.Sound"]] = {}
+
+        self._build_backgrounds()
+
+        self.screen_state = "menu"
+        self.menu_idx = 0
+
+        self.player_name = os.getenv("TSR_PLAYER") or "Jugador/a"
+        self._apply_character(5)
+        self.mode = "carreras"
+        self.tick_ms = 200
+        self.target_duration_s = 60
+        self.half_duration_s = 45
+        self.api_url = os.getenv("TSR_API") or "http://localhost:3000/api/sessions"
+        # El POST corre en un hilo aparte para no congelar el bucle de pygame
+        self._sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tsr-sync")
+        self._sync_future: Optional[Future] = None
+        self._sync_pending_hash: Optional[str] = None
+        self._last_sync_hash: Optional[str] = None
+
+        self.running = False
+        self.paused = False
+        self.elapsed_ms = 0
+        self.score = 0.0
+        self.lap = 1
+        self.enemy_score = 0
+        self.last_tick = 0
+
+        self.session: Optional[Session] = None
+        self.last_saved_payload: Optional[dict] = None
+        self.message = ""
+        self.msg_until = 0
+
+        self.speed = 20.0
+        # Coches en columnas paralelas (índice 0 = jugador) en vez de un dict por coche
+        self.car_name: List[str] = []
+        self.car_color: List[Tuple[int, int, int]] = []
+        self.car_x: List[float] = []
+        self.car_y: List[float] = []
+        self.car_speed: List[float] = []
+        self.car_dist: List[float] = []
+
+        self.player_pos = pg.Vector2(120, HEIGHT / 2)
+        self.ball_pos = pg.Vector2(WIDTH / 2, HEIGHT / 2)
+        self.ball_vel = pg.Vector2(0, 0)
+        self.npcs: List[dict] = []
+        # Posiciones enteras para dibujar, calculadas al final de cada paso de física
+        self.player_pos_i = (120, HEIGHT // 2)
+        self.ball_pos_i = (WIDTH // 2, HEIGHT // 2)
+
+        self.powerups: List[dict] = []
+        self.active_pu: Dict[str, int] = {}
+        # (expira_ms, tipo) en un min-heap; active_pu sigue siendo la fuente de verdad
+        self._pu_expiry: List[Tuple[int, str]] = []
+        self.next_pu_spawn_ms = 2500
+
+        # Top 10 del ranking: se consulta al entrar en la pantalla o tras guardar, no por frame,
+        # y en un hilo aparte para que una consulta lenta no frene el render
+        self._ranking_rows: List[Dict] = []
+        self._ranking_dirty = True
+        self._ranking_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tsr-rank")
+        self._ranking_future: Optional[Future] = None
+
+        self._build_game_keys()
+        self._build_menu_keys()
+
+        orm_ensure_bots(self.org_id, BOT_NAMES_RACE + BOT_NAMES_FOOT)
+
+    def info(self, text: str, ms: int = 2200):
+        self.message = text
+        self.msg_until = pg.time.get_ticks() + ms
+
+    def _build_backgrounds(self):
+        # Pista y cancha son geometría fija: se dibujan una vez y cada frame es un solo blit
+        self._race_bg = pg.Surface((WIDTH, HEIGHT)).convert()
+        self._race_bg.fill((8, 10, 22))
+        pg.draw.rect(self._race_bg, (30, 30, 35), (0, int(HEIGHT * 0.22), WIDTH, int(HEIGHT * 0.56)))
+        pg.draw.line(self._race_bg, (240, 240, 240), (0, HEIGHT // 2), (WIDTH, HEIGHT // 2), 3)
+        pg.draw.rect(self._race_bg, (220, 40, 80), (WIDTH - 18, int(HEIGHT * 0.22), 18, int(HEIGHT * 0.56)))
+
+        self._foot_bg = pg.Surface((WIDTH, HEIGHT)).convert()
+        self._foot_bg.fill((10, 120, 70))
+        pg.draw.rect(self._foot_bg, (255, 255, 255), (12, 76, WIDTH - 24, HEIGHT - 120), 2)
+        pg.draw.line(self._foot_bg, (255, 255, 255), (WIDTH // 2, 76), (WIDTH // 2, HEIGHT - 44), 2)
+        pg.draw.circle(self._foot_bg, (255, 255, 255), (WIDTH // 2, HEIGHT // 2 + 16), 42, 2)
+        goal_top, goal_bot = int(HEIGHT * 0.35), int(HEIGHT * 0.65)
+        pg.draw.rect(self._foot_bg, (255, 255, 255), (0, goal_top, 12, goal_bot - goal_top), 2)
+        pg.draw.rect(self._foot_bg, (255, 255, 255), (WIDTH - 12, goal_top, 12, goal_bot - goal_top), 2)
+
+    def render_cached(self, font, text: str, color) -> pg.Surface:
+        # Los textos de HUD/menú/ranking cambian pocas veces por segundo: se rasterizan una vez
+        key = (font, text, color)
+        surf = self._text_cache.get(key)
+        if surf is None:
+            if len(self._text_cache) >= 256:
+                self._text_cache.clear()
+            surf = font.render(text, True, color)
+            self._text_cache[key] = surf
+        return surf
+
+    def sprite_circle(self, color, r: int) -> pg.Surface:
+        # Círculos de power-ups, NPCs y pelota: se dibujan una vez y luego van en un solo fblits
+        key = ("circle", color, r)
+        surf = self._sprite_cache.get(key)
+        if surf is None:
+            surf = pg.Surface((2 * r, 2 * r), pg.SRCALPHA).convert_alpha()
+            pg.draw.circle(surf, color, (r, r), r)
+            self._sprite_cache[key] = surf
+        return surf
+
+    def sprite_car(self, color) -> pg.Surface:
+        key = ("car", color)
+        surf = self._sprite_cache.get(key)
+        if surf is None:
+            surf = pg.Surface((44, 36), pg.SRCALPHA).convert_alpha()
+            pg.draw.rect(surf, color, (0, 0, 44, 36), border_radius=6)
+            self._sprite_cache[key] = surf
+        return surf
+
+    def get_snd(self, key: str):
+        if key not in self._snd_cache:
+            name, volume = SOUNDS[key]
+            self._snd_cache[key] = load_snd(name, volume)
+        return self._snd_cache[key]
+
+    def get_img(self, name: str, size: Optional[Tuple[int, int]] = None):
+        # Se guarda ya escalada: el sprite siempre se dibuja al mismo tamaño
+        key = ("img", name, size)
+        if key not in self._sprite_cache:
+            img = load_img(name)
+            if img is not None and size is not None:
+                img = pg.transform.smoothscale(img, size)
+            self._sprite_cache[key] = img
+        return self._sprite_cache[key]
+
+    def _dragon_sprite(self):
+        return self.get_img("dragon.png", (52, 52))
+
+    def play_snd(self, key: str):
+        if self.muted:
+            return
+        snd = self.get_snd(key)
+        if snd is None:
+            return
+        try:
+            snd.play()
+        except Exception:
+            pass
+
+    def _apply_character(self, idx: int):
+        # El personaje solo cambia desde el menú: el dibujo lee estas referencias sin indexar
+        self.player_character_idx = idx % len(CHARACTERS)
+        self.player_ch = CHARACTERS[self.player_character_idx]
+        self.player_label = self.player_ch["name"]
+        self.player_color = self.player_ch["color"]
+
+    def _init_race_bots(self):
+        lanes = [HEIGHT * 0.30, HEIGHT * 0.38, HEIGHT * 0.46, HEIGHT * 0.54, HEIGHT * 0.62]
+        random.shuffle(lanes)
+
+        self.car_name = [f"{self.player_label} ({self.player_name})"]
+        self.car_color = [self.player_color]
+        self.car_x = [60.0]
+        self.car_y = [lanes[0]]
+        self.car_speed = [self.speed]
+        self.car_dist = [0.0]
+
+        for i in range(1, min(5, len(lanes))):
+            self.car_name.append(BOT_NAMES_RACE[i - 1])
+            self.car_color.append((180, 180, 200) if i % 2 == 0 else (200, 150, 80))
+            self.car_x.append(float(random.randint(20, 180)))
+            self.car_y.append(lanes[i])
+            self.car_speed.append(random.uniform(12, 28))
+            self.car_dist.append(0.0)
+
+    def _init_football_npcs(self):
+        self.npcs = []
+        for i in range(3):
+            self.npcs.append({
+                "name": BOT_NAMES_FOOT[i],
+                "color": (210, 80, 80),
+                "pos": pg.Vector2(random.randint(WIDTH // 2 + 40, WIDTH - 60), random.randint(60, HEIGHT - 60)),
+                "role": "rival",
+                "speed": 0.7,
+            })
+        for i in range(2):
+            self.npcs.append({
+                "name": BOT_NAMES_FOOT[3 + i],
+                "color": (80, 180, 250),
+                "pos": pg.Vector2(random.randint(60, WIDTH // 2 - 60), random.randint(60, HEIGHT - 60)),
+                "role": "ally",
+                "speed": 0.45,
+            })
+
+    def get_limit_ms(self) -> int:
+        if self.mode == "carreras":
+            return int(self.target_duration_s * 1000)
+        return int(2 * self.half_duration_s * 1000)
+
+    def start_session(self):
+        self.session = Session(self.player_name, self.mode)
+        self.running = True
+        self.paused = False
+        self.elapsed_ms = 0
+        self.score = 0.0
+        self.lap = 1
+        self.enemy_score = 0
+        self.last_tick = 0
+
+        # Carga diferida, pero antes del primer frame: sin tirones al primer gol o pickup
+        for key in SOUNDS:
+            self.get_snd(key)
+
+        self.powerups.clear()
+        self.active_pu.clear()
+        self._pu_expiry.clear()
+        self.next_pu_spawn_ms = 2500
+
+        self.player_pos.update(120, HEIGHT / 2)
+        self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
+        self.ball_vel.update(0, 0)
+
+        self._init_race_bots()
+        if self.player_label == "Dragoncito":
+            self._dragon_sprite()
+        self._init_football_npcs()
+        self._update_int_positions()
+
+        self._hud_dirty = True
+        self.info("Sesión iniciada (ENTER nueva, ESPACIO pausa)")
+        orm_get_or_create_player(self.org_id, self.player_name, is_bot=False)
+
+    def _register_split_tick(self):
+        if not self.session:
+            return
+        self.session.add_split(int(self.elapsed_ms), round(self.score, 2), int(self.lap))
+
+    def register_event(self, note: str):
+        if not self.session:
+            return
+        self.session.add_split(int(self.elapsed_ms), round(self.score, 2), int(self.lap), note)
+        self._hud_dirty = True
+
+    def finish_session(self):
+        if not self.session:
+            return
+        self.running = False
+        limit = self.get_limit_ms()
+        self.session.totalScore = round(self.score, 2)
+        self.session.durationMs = max(self.elapsed_ms, limit)
+
+        payload = {
+            "id": self.session.id,
+            "player": self.session.player,
+            "mode": self.session.mode,
+            "startedAt": self.session.startedAt,
+            "durationMs": self.session.durationMs,
+            "totalScore": self.session.totalScore,
+            "splits": [{"t": t, "lap": lap, "score": sc, "note": note}
+                       for t, sc, lap, note in zip(self.session.split_t, self.session.split_score,
+                                                   self.session.split_lap, self.session.split_note)],
+        }
+
+        self.finish_session_and_rate(payload)
+        self.last_saved_payload = payload
+        self._ranking_dirty = True
+        self._request_ranking()
+        self.info("Guardado OK (DB) + Rating actualizado (Glicko-2)")
+
+    def finish_session_and_rate(self, payload: dict):
+        # Sesión + splits + match + ratings en una sola transacción: un commit en vez de seis
+        with timed("db"), SessionLocal() as db:
+            orm_save_session_with_splits(self.org_id, payload, db=db)
+            self._persist_match_and_update_glicko(db)
+            db.commit()
+        orm_invalidate_leaderboard()
+
+    def _persist_match_and_update_glicko(self, db):
+        p1 = orm_get_or_create_player(self.org_id, self.player_name, is_bot=False, db=db)
+
+        if self.mode == "carreras":
+            bot = None
+            best_dist = -1.0
+            player_dist = self.car_dist[0] if self.car_dist else 0.0
+            for i in range(1, len(self.car_dist)):
+                if self.car_dist[i] > best_dist:
+                    best_dist = self.car_dist[i]
+                    bot = i
+            if bot is None:
+                bot_name = BOT_NAMES_RACE[0]
+                bot_score = 0.0
+            else:
+                bot_name = self.car_name[bot]
+                bot_score = best_dist
+            score1 = player_dist
+            score2 = bot_score
+            outcome1 = 0.5 if abs(score1 - score2) < 1e-9 else (1.0 if score1 > score2 else 0.0)
+        else:
+            bot_name = "Rival-1"
+            score1 = float(self.score)
+            score2 = float(self.enemy_score)
+            outcome1 = 0.5 if score1 == score2 else (1.0 if score1 > score2 else 0.0)
+
+        p2 = orm_get_or_create_player(self.org_id, bot_name, is_bot=True, db=db)
+
+        orm_save_match(self.org_id, self.session.id, self.mode, p1, p2, score1, score2, outcome1, db=db)
+        with timed("glicko"):
+            (nr1, nrd1, nvol1), (nr2, nrd2, nvol2) = apply_single_match_glicko(p1, p2, outcome1, tau=0.5)
+        orm_update_players_glicko([(p1.id, nr1, nrd1, nvol1), (p2.id, nr2, nrd2, nvol2)], db=db)
+
+    def export_csv_last(self):
+        if not self.last_saved_payload:
+            self.info("No hay sesión guardada aún")
+            return
+        p = self.last_saved_payload
+        fname = f"timesplit_{safe_filename(p['mode'])}_{safe_filename(p['player'])}_{p['startedAt']}.csv"
+        header = ["player", "mode", "startedAt", "durationMs", "totalScore", "t(ms)", "lap/periodo", "score", "note"]
+        # Se escribe a .tmp y se renombra: nunca queda un CSV a medio escribir
+        tmp = fname + ".tmp"
+        try:
+            # Las 5 primeras columnas son iguales en todas las filas: se arman una vez
+            prefix = [p["player"], p["mode"], p["startedAt"], p["durationMs"], p["totalScore"]]
+            with open(tmp, "w", newline="", encoding="utf-8", buffering=1 << 16) as f:
+                w = csv.writer(f)
+                w.writerow(header)
+                w.writerows(prefix + [sp["t"], sp["lap"], sp["score"], sp.get("note") or ""]
+                            for sp in p.get("splits", []))
+            os.replace(tmp, fname)
+            self.info(f"CSV exportado: {fname}")
+        except Exception as e:
+            remove_quiet(tmp)
+            self.info(f"Error exportando CSV: {e}")
+
+    def export_xlsx_last(self):
+        if openpyxl is None:
+            self.info("Falta openpyxl (pip install openpyxl)")
+            return
+        if not self.last_saved_payload:
+            self.info("No hay sesión guardada aún")
+            return
+        p = self.last_saved_payload
+        fname = f"timesplit_{safe_filename(p['mode'])}_{safe_filename(p['player'])}_{p['startedAt']}.xlsx"
+        tmp = fname + ".tmp"
+        try:
+            # write_only: las filas se vuelcan al guardar sin crear un objeto celda por valor;
+            # los anchos de columna tienen que fijarse antes del primer append
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet("splits")
+            for col in range(1, 5):
+                ws.column_dimensions[get_column_letter(col)].width = 18
+            ws.column_dimensions[get_column_letter(4)].width = 28
+            ws.append(["player", "mode", "startedAt", "durationMs", "totalScore"])
+            ws.append([p["player"], p["mode"], p["startedAt"], p["durationMs"], p["totalScore"]])
+            ws.append([])
+            ws.append(["t(ms)", "lap/periodo", "score", "note"])
+            for sp in p.get("splits", []):
+                ws.append([sp["t"], sp["lap"], sp["score"], sp.get("note") or ""])
+            wb.save(tmp)
+            os.replace(tmp, fname)
+            self.info(f"Excel exportado: {fname}")
+        except Exception as e:
+            remove_quiet(tmp)
+            self.info(f"Error exportando Excel: {e}")
+
+    def sync_last_api(self):
+        if not self.last_saved_payload:
+            self.info("No hay sesión guardada aún")
+            return
+        if self._sync_future is not None:
+            self.info("Sync en curso…")
+            return
+        # No se re-sube un payload idéntico al último sincronizado con éxito
+        body = dumps_json(self.last_saved_payload)
+        h = hashlib.blake2b(body, digest_size=16).hexdigest()
+        if h == self._last_sync_hash:
+            self.info("Sync API: sin cambios")
+            return
+        self._sync_pending_hash = h
+        self._sync_future = self._sync_executor.submit(sync_to_api, body, self.api_url)
+        self.info("Sync API enviado…")
+
+    def _poll_sync(self):
+        fut = self._sync_future
+        if fut is None or not fut.done():
+            return
+        self._sync_future = None
+        ok, text = fut.result()
+        if ok:
+            self._last_sync_hash = self._sync_pending_hash
+        self._sync_pending_hash = None
+        self.info(f"Sync API OK ({text})" if ok else f"Error sync API: {text}")
+
+    def _request_ranking(self):
+        if not self._ranking_dirty or self._ranking_future is not None:
+            return
+        self._ranking_dirty = False
+        self._ranking_future = self._ranking_executor.submit(orm_leaderboard_glicko, self.org_id, 10)
+
+    def _poll_ranking(self):
+        fut = self._ranking_future
+        if fut is None or not fut.done():
+            return
+        self._ranking_future = None
+        try:
+            self._ranking_rows = fut.result()
+        except Exception as e:
+            self.info(f"Error leyendo ranking: {e}")
+        self._static_dirty = True
+
+    def _spawn_powerup(self):
+        kinds = [PU_TURBO, PU_SHIELD, PU_FIRE, PU_FREEZE, PU_DRAGON]
+        self.powerups.append({"kind": random.choice(kinds),
+                              "pos": (random.randint(120, WIDTH - 120), random.randint(90, HEIGHT - 90)),
+                              "t": self.elapsed_ms})
+
+    def _update_powerups(self):
+        if self.elapsed_ms >= self.next_pu_spawn_ms:
+            self._spawn_powerup()
+            self.next_pu_spawn_ms += random.randint(2200, 4200)
+        # Comparación con distancia al cuadrado: sin sqrt por power-up y frame
+        pickup_r2 = 22 * 22
+        if self.mode == "futbol":
+            px, py = self.player_pos.x, self.player_pos.y
+        else:
+            px, py = 140, (self.car_y[0] if self.car_y else HEIGHT / 2)
+        # Recorrido inverso con pop solo al recoger: el frame sin recogidas no asigna nada
+        pus = self.powerups
+        for i in range(len(pus) - 1, -1, -1):
+            pu = pus[i]
+            dx = pu["pos"][0] - px
+            dy = pu["pos"][1] - py
+            if dx * dx + dy * dy <= pickup_r2:
+                self.play_snd("pick")
+                until = self.elapsed_ms + 3500
+                self.active_pu[pu["kind"]] = until
+                heapq.heappush(self._pu_expiry, (until, pu["kind"]))
+                self.register_event(f"PICK {pu['kind']}")
+                pus.pop(i)
+        # Las entradas viejas de un power-up recogido otra vez no coinciden y se descartan
+        heap = self._pu_expiry
+        while heap and heap[0][0] <= self.elapsed_ms:
+            until, k = heapq.heappop(heap)
+            if self.active_pu.get(k) == until:
+                del self.active_pu[k]
+                self._hud_dirty = True
+
+    def _update_carreras(self, dt_ms: int):
+        speed = self.speed * (1.35 if PU_TURBO in self.active_pu else 1.0)
+        car_speed, car_dist, car_x = self.car_speed, self.car_dist, self.car_x
+        if not car_dist:
+            return
+        car_speed[0] = speed
+        k = dt_ms / 1000.0
+        span = WIDTH - 140
+        for i in range(len(car_dist)):
+            d = car_dist[i] + car_speed[i] * k
+            car_dist[i] = d
+            car_x[i] = 60 + (d * 10) % span
+        self.score = car_dist[0]
+
+    def _update_futbol(self, dt_ms: int):
+        vel = self.ball_vel
+        # Pelota quieta (tras gol o reinicio): no hay nada que integrar ni rebotar
+        if vel.x or vel.y:
+            # Componente a componente: vel * k crearía un Vector2 nuevo en cada paso
+            k = dt_ms / 16.0
+            pos = self.ball_pos
+            pos.x += vel.x * k
+            pos.y += vel.y * k
+            vel *= 0.992 ** (dt_ms / FRAME_REF_MS)
+            if abs(vel.x) + abs(vel.y) < 0.01:
+                vel.update(0, 0)
+            else:
+                if self.ball_pos.y < 18 or self.ball_pos.y > HEIGHT - 18:
+                    vel.y *= -1
+                if self.ball_pos.x < 18 or self.ball_pos.x > WIDTH - 18:
+                    vel.x *= -1
+
+        # Avance in situ hacia la pelota: sin Vector2 temporal ni raíz cuadrada por NPC
+        ball = self.ball_pos
+        frames = dt_ms / FRAME_REF_MS
+        for npc in self.npcs:
+            pos = npc["pos"]
+            if pos.distance_squared_to(ball) > 1:
+                pos.move_towards_ip(ball, npc["speed"] * frames)
+
+        goal_top, goal_bot = int(HEIGHT * 0.35), int(HEIGHT * 0.65)
+        if self.ball_pos.x <= 10 and goal_top <= self.ball_pos.y <= goal_bot:
+            self.enemy_score += 1
+            self.play_snd("goal")
+            self.register_event("GOAL EN CONTRA")
+            self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
+            self.ball_vel.update(0, 0)
+        if self.ball_pos.x >= WIDTH - 10 and goal_top <= self.ball_pos.y <= goal_bot:
+            self.score += 1
+            self.play_snd("goal")
+            self.register_event("GOAL A FAVOR")
+            self.ball_pos.update(WIDTH / 2, HEIGHT / 2)
+            self.ball_vel.update(0, 0)
+
+        self._update_int_positions()
+
+    def _update_int_positions(self):
+        self.player_pos_i = (int(self.player_pos.x), int(self.player_pos.y))
+        self.ball_pos_i = (int(self.ball_pos.x), int(self.ball_pos.y))
+        for npc in self.npcs:
+            npc["pos_i"] = (int(npc["pos"].x), int(npc["pos"].y))
+
+    def _draw_hud(self):
+        if self._hud_dirty:
+            self._hud_lines = (
+                f"Modo: {self.mode} | Tick: {self.tick_ms}ms | Duración objetivo: {self.get_limit_ms()//1000}s",
+                None if self.mode == "carreras" else f"Goles: {int(self.score)} (Rivales {self.enemy_score}) | Periodo: {self.lap}",
+                f"Power-ups: {' '.join(self.active_pu)}" if self.active_pu else None,
+            )
+            self._hud_dirty = False
+        top, goals, pu_line = self._hud_lines
+        pg.draw.rect(self.screen, (15, 18, 30), (0, 0, WIDTH, 58))
+        self.screen.blit(self.render_cached(self.font, top, (220, 230, 255)), (14, 10))
+        # El reloj y la distancia no pasan por la caché de textos (la llenarían de valores únicos):
+        # se guarda solo la última superficie y se re-rasteriza cuando cambia lo que se ve
+        clock_cs = self.elapsed_ms // 10
+        if clock_cs != self._clock_cs:
+            self._clock_cs = clock_cs
+            self._clock_surf = self.big.render(fmt_ms(clock_cs * 10), True, (255, 255, 255))
+        self.screen.blit(self._clock_surf, (14, 28))
+        if self.mode == "carreras":
+            dist_text = f"Puntaje(dist): {self.score:.2f} | Vuelta: {self.lap}"
+            if dist_text != self._dist_text:
+                self._dist_text = dist_text
+                self._dist_surf = self.big.render(dist_text, True, (200, 255, 200))
+            s = self._dist_surf
+        else:
+            s = self.render_cached(self.big, goals, (200, 255, 200))
+        self.screen.blit(s, (250, 26))
+        if pu_line:
+            self.screen.blit(self.render_cached(self.font, pu_line, (255, 210, 120)), (14, 56))
+        # Sin mensaje activo basta comparar un entero; al expirar se limpia
+        if self.msg_until:
+            if pg.time.get_ticks() < self.msg_until:
+                msg = self.render_cached(self.font, self.message, (255, 220, 220))
+                self.screen.blit(msg, (14, HEIGHT - 24))
+            else:
+                self.msg_until = 0
+                self.message = ""
+
+    def _draw_carreras(self):
+        self.screen.blit(self._race_bg, (0, 0))
+        # Coches, nombres y power-ups van en una sola llamada a C
+        seq = []
+        for i in range(len(self.car_x)):
+            x = int(self.car_x[i]); y = int(self.car_y[i])
+            dragon = self._dragon_sprite() if i == 0 and self.player_label == "Dragoncito" else None
+            if dragon is not None:
+                seq.append((dragon, (x, y - 26)))
+            else:
+                seq.append((self.sprite_car(self.car_color[i]), (x, y - 18)))
+            seq.append((self.render_cached(self.font, self.car_name[i], (220, 220, 220)), (x + 50, y - 10)))
+        pu_surf = self.sprite_circle((255, 210, 120), 10)
+        for pu in self.powerups:
+            x, y = pu["pos"]
+            seq.append((pu_surf, (x - 10, y - 10)))
+        self.screen.fblits(seq)
+
+    def _draw_futbol(self):
+        self.screen.blit(self._foot_bg, (0, 0))
+        ch = self.player_ch
+        px, py = self.player_pos_i
+        dragon = self._dragon_sprite() if ch["name"] == "Dragoncito" else None
+        if dragon is not None:
+            seq = [(dragon, (px - 26, py - 26))]
+        else:
+            seq = [(self.sprite_circle(ch["color"], 12), (px - 12, py - 12))]
+        for npc in self.npcs:
+            x, y = npc["pos_i"]
+            seq.append((self.sprite_circle(npc["color"], 10), (x - 10, y - 10)))
+        bx, by = self.ball_pos_i
+        seq.append((self.sprite_circle((250, 250, 250), 7), (bx - 7, by - 7)))
+        pu_surf = self.sprite_circle((255, 210, 120), 10)
+        for pu in self.powerups:
+            x, y = pu["pos"]
+            seq.append((pu_surf, (x - 10, y - 10)))
+        self.screen.fblits(seq)
+
+    def _build_menu_keys(self):
+        # Alineado con las opciones de _draw_menu: ENTER indexa la acción por menu_idx
+        self._menu_actions = (
+            lambda: self._menu_play("carreras"),
+            lambda: self._menu_play("futbol"),
+            self._menu_ranking,
+            self._menu_quit,
+        )
+        self._menu_keys = {
+            pg.K_ESCAPE: self._menu_quit,
+            pg.K_DOWN: lambda: self._menu_move(+1),
+            pg.K_UP: lambda: self._menu_move(-1),
+            pg.K_m: self._menu_toggle_mute,
+            pg.K_RETURN: self._menu_select,
+        }
+        for i in range(len(CHARACTERS)):
+            self._menu_keys[pg.K_1 + i] = lambda i=i: self._menu_pick_character(i)
+
+    def _handle_menu_event(self, ev):
+        action = self._menu_keys.get(ev.key)
+        if action is not None:
+            action()
+
+    def _menu_quit(self):
+        raise SystemExit
+
+    def _menu_move(self, delta: int):
+        self.menu_idx = (self.menu_idx + delta) % len(self._menu_actions)
+
+    def _menu_toggle_mute(self):
+        self.muted = not self.muted
+        self.info("Mute ON" if self.muted else "Mute OFF")
+
+    def _menu_pick_character(self, idx: int):
+        self._apply_character(idx)
+        self.info(f"Personaje: {self.player_label}")
+
+    def _menu_select(self):
+        self._menu_actions[self.menu_idx]()
+
+    def _menu_play(self, mode: str):
+        self.mode = mode; self.start_session(); self.screen_state = "game"
+
+    def _menu_ranking(self):
+        self._ranking_dirty = True
+        self.screen_state = "ranking"
+
+    def _build_game_keys(self):
+        # Tecla -> acción: un dict.get por pulsación en vez de recorrer toda la cadena de ifs
+        self._game_keys = {
+            pg.K_ESCAPE: self._key_back_to_menu,
+            pg.K_SPACE: self._key_toggle_pause,
+            pg.K_RETURN: self.start_session,
+            pg.K_TAB: self._key_toggle_mode,
+            pg.K_r: self.start_session,
+            pg.K_l: self._key_next_lap,
+            pg.K_LEFTBRACKET: lambda: self._key_tick(-50),
+            pg.K_RIGHTBRACKET: lambda: self._key_tick(+50),
+            pg.K_MINUS: lambda: self._key_duration(-5),
+            pg.K_PLUS: lambda: self._key_duration(+5),
+            pg.K_EQUALS: lambda: self._key_duration(+5),
+            pg.K_s: self.finish_session,
+            pg.K_e: self.export_csv_last,
+            pg.K_x: self.export_xlsx_last,
+            pg.K_u: self.sync_last_api,
+            pg.K_UP: lambda: self._key_speed(+2.0),
+            pg.K_DOWN: lambda: self._key_speed(-2.0),
+            pg.K_f: self._key_shoot,
+        }
+
+    def _handle_game_event(self, ev):
+        self._hud_dirty = True
+        action = self._game_keys.get(ev.key)
+        if action is not None:
+            action()
+
+    def _key_back_to_menu(self):
+        self.screen_state = "menu"; self.running = False
+
+    def _key_toggle_pause(self):
+        self.paused = not self.paused; self.info("Pausa" if self.paused else "Reanudar")
+
+    def _key_toggle_mode(self):
+        self.mode = "futbol" if self.mode == "carreras" else "carreras"
+        self.start_session(); self.info(f"Modo: {self.mode}")
+
+    def _key_next_lap(self):
+        self.lap = min(self.lap + 1, 99)
+        self.register_event("LAP/PERIODO")
+
+    def _key_tick(self, delta: int):
+        self.tick_ms = max(50, min(1000, self.tick_ms + delta)); self.info(f"Tick: {self.tick_ms} ms")
+
+    def _key_duration(self, delta: int):
+        if self.mode == "carreras": self.target_duration_s = max(10, min(180, self.target_duration_s + delta))
+        else: self.half_duration_s = max(15, min(120, self.half_duration_s + delta))
+
+    def _key_speed(self, delta: float):
+        if self.mode == "carreras":
+            self.speed = max(0.0, min(200.0, self.speed + delta))
+
+    def _key_shoot(self):
+        if self.mode != "carreras":
+            self.shoot()
+
+    def shoot(self):
+        d = self.ball_pos - self.player_pos
+        ls = d.length_squared()
+        if 0 < ls < 42 * 42:
+            power = 7.5 + random.random() * 5.0
+            # Una sola raíz, y solo cuando el tiro sale
+            self.ball_vel = d * (power * 20 / math.sqrt(ls))
+            self.play_snd("shoot")
+            self.register_event("SHOT")
+
+    def _draw_menu(self):
+        self.screen.fill((8, 10, 22))
+        title = self.render_cached(self.big, "TimeSplit — Dragoncito (Postgres + Glicko-2)", (240, 240, 255))
+        self.screen.blit(title, (40, 40))
+        subtitle = self.render_cached(self.font, "↑/↓ elegir · ENTER · 1..6 personaje · M mute", (190, 200, 230))
+        self.screen.blit(subtitle, (40, 78))
+        opts = ["Jugar Carreras", "Jugar Fútbol", "Ver Ranking (Glicko-2)", "Salir"]
+        y = 140
+        for i, o in enumerate(opts):
+            col = (255, 255, 255) if i == self.menu_idx else (170, 180, 210)
+            self.screen.blit(self.render_cached(self.big, o, col), (70, y))
+            y += 54
+        ch = self.player_ch
+        p = self.render_cached(self.font, f"Jugador: {self.player_name} | Personaje: {ch['name']} | DB: {'Postgres' if os.getenv('DATABASE_URL') else 'SQLite'}", (210, 210, 210))
+        self.screen.blit(p, (40, HEIGHT - 36))
+
+    def _draw_ranking(self):
+        self.screen.fill((10, 10, 18))
+        self.screen.blit(self.render_cached(self.big, "Ranking (Glicko-2) — TOP 10", (240, 240, 255)), (40, 36))
+        self.screen.blit(self.render_cached(self.font, "ESC volver al menú", (170, 180, 210)), (40, 66))
+        self._request_ranking()
+        rows = self._ranking_rows
+        y = 120
+        self.screen.blit(self.render_cached(self.font, "Pos   Jugador                Rating    RD     Vol", (220, 220, 220)), (60, y))
+        y += 22
+        if not rows and self._ranking_future is not None:
+            self.screen.blit(self.render_cached(self.font, "Cargando…", (170, 180, 210)), (60, y))
+        for idx, r in enumerate(rows, start=1):
+            line = f"{idx:>2}   {r['player'][:20]:<20}   {r['rating']:>7.1f}  {r['rd']:>6.1f}  {r['vol']:.4f}"
+            col = (200, 230, 200) if idx == 1 else (200, 200, 200)
+            self.screen.blit(self.render_cached(self.font, line, col), (60, y))
+            y += 22
+
+    def _step(self, dt: int, direction):
+        self.elapsed_ms += dt
+        self._update_powerups()
+        if self.mode == "carreras":
+            self._update_carreras(dt)
+        else:
+            if direction is not None:
+                step = (3.4 if PU_TURBO in self.active_pu else 2.6) * (dt / FRAME_REF_MS)
+                pos = self.player_pos
+                pos.x = max(30, min(WIDTH - 30, pos.x + direction[0] * step))
+                pos.y = max(90, min(HEIGHT - 60, pos.y + direction[1] * step))
+            self._update_futbol(dt)
+
+        if self.elapsed_ms - self.last_tick >= self.tick_ms:
+            self.last_tick = self.elapsed_ms
+            self._register_split_tick()
+
+        if self.elapsed_ms >= self.get_limit_ms():
+            self.finish_session()
+
+    def shutdown_workers(self):
+        # Los hilos de los executors no son daemon: sin esto, salir con un POST en curso
+        # deja el proceso vivo hasta el timeout de la petición
+        self._sync_executor.shutdown(wait=False, cancel_futures=True)
+        self._ranking_executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        try:
+            self._run_loop()
+        finally:
+            self.shutdown_workers()
+
+    def _run_loop(self):
+        # Paso fijo: el tiempo real (perf_counter) se acumula y la física avanza en pasos de
+        # FIXED_DT_MS, así el resultado no depende de los FPS; tick() solo limita el render
+        last = time.perf_counter()
+        accum_ms = 0.0
+        # Menú y ranking son estáticos: solo se redibujan (y presentan) tras un evento o cambio de pantalla
+        drawn_state = None
+        while True:
+            self.clock.tick(FPS)
+            now = time.perf_counter()
+            frame_ms = (now - last) * 1000.0
+            last = now
+            for ev in pg.event.get():
+                if ev.type == pg.QUIT:
+                    raise SystemExit
+                if ev.type in _REDRAW_EVENTS:
+                    # Ventana descubierta o restaurada: menú/ranking se repintan aunque no haya teclas
+                    self._static_dirty = True
+                    continue
+                # pygame sigue entregando algunos eventos de ventana pese al filtro
+                if ev.type != pg.KEYDOWN:
+                    continue
+                self._static_dirty = True
+                if ev.key == pg.K_F1 and PROFILE:
+                    print("\n".join(timing_report()) or "sin mediciones aún")
+                    continue
+                if self.screen_state == "menu":
+                    self._handle_menu_event(ev)
+                elif self.screen_state == "game":
+                    self._handle_game_event(ev)
+                elif self.screen_state == "ranking":
+                    if ev.key == pg.K_ESCAPE:
+                        self.screen_state = "menu"
+
+            self._poll_sync()
+            self._poll_ranking()
+
+            if self.screen_state == "game" and self.running and not self.paused:
+                # Tope por frame: tras un parón (arrastrar la ventana, guardar) no se encadenan cientos de pasos
+                accum_ms += min(frame_ms, MAX_FRAME_MS)
+                keys = pg.key.get_pressed()
+                direction = _DIR_LUT[(keys[pg.K_UP] << 3) | (keys[pg.K_DOWN] << 2)
+                                     | (keys[pg.K_LEFT] << 1) | keys[pg.K_RIGHT]]
+                with timed("step"):
+                    while accum_ms >= FIXED_DT_MS and self.running:
+                        self._step(FIXED_DT_MS, direction)
+                        accum_ms -= FIXED_DT_MS
+            else:
+                accum_ms = 0.0
+
+            if self.screen_state == "game":
+                with timed("draw"):
+                    if self.mode == "carreras":
+                        self._draw_carreras()
+                    else:
+                        self._draw_futbol()
+                    self._draw_hud()
+                pg.display.flip()
+            elif self._static_dirty or self.screen_state != drawn_state:
+                with timed("draw"):
+                    if self.screen_state == "menu":
+                        self._draw_menu()
+                    else:
+                        self._draw_ranking()
+                pg.display.flip()
+                self._static_dirty = False
+            drawn_state = self.screen_state
+
+if __name__ == "__main__":
+    Game().run()